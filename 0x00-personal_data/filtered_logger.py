@@ -2,15 +2,283 @@
 """
 Personal Data logging tasks
 """
+import argparse
+import atexit
+import gzip
+import hashlib
+import hmac
 import logging
+import multiprocessing
+import os
+import queue
 import re
-from typing import List
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener
+from typing import (BinaryIO, Callable, Dict, Iterable, Iterator, List,
+                    Pattern, Tuple, TypeVar, Union)
+
+Connection = TypeVar('Connection')
 
 PII_FIELDS = ("name", "email", "phone", "SSN", "password")
+PLAN_CACHE_SIZE = 128
+QUEUE_SIZE = 10000
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop")
+ENGINES = ("regex", "automaton")
+CHUNK_SIZE = 4 * 1024 * 1024
+BATCH_SIZE = 4096
+BUFFER_CAPACITY = 1000
+FLUSH_MS = 500
+SUMMARY_SECONDS = 10
+TOKEN_CACHE_SIZE = 65536
+TOKEN_LENGTH = 16
+EXPORT_FIELDS = "_export_fields"
+RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {
+    "message", "asctime"}
+
+
+class FieldScanner:
+    """ Reversed trie of field names matched backwards from each "="
+
+    A field match is "field=" and field names hold no "=", so every match
+    ends on the first "=" after its start. The leftmost match is therefore
+    the longest field ending just before the first "=" that has one, and
+    finding it costs one trie walk per "=" whatever the number of fields.
+    """
+
+    def __init__(self, fields: Tuple[str, ...]):
+        """
+        Build the trie of the reversed field names.
+
+        Args:
+            fields (tuple): Field names to match, none containing "=".
+        """
+        self.root = {}
+        for field in fields:
+            node = self.root
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[None] = True
+
+    def match_start(self, message: str, equal: int, lower: int) -> int:
+        """
+        Find where the longest field ending before an "=" starts.
+
+        Args:
+            message (str): String representing the log line.
+            equal (int): Index of the "=" following the field.
+            lower (int): Lowest index the field may start at.
+
+        Returns:
+            int: Index of the field start, or -1 if no field matches.
+        """
+        node = self.root
+        start = equal if None in node else -1
+        index = equal - 1
+        while index >= lower:
+            node = node.get(message[index])
+            if node is None:
+                break
+            if None in node:
+                start = index
+            index -= 1
+        return start
+
+    def sub(self, redaction: Union[str, Callable[[str], str]], message: str,
+            value: Pattern) -> str:
+        """
+        Replace the value of every field with the redaction.
+
+        Args:
+            redaction (str or callable): String replacing each field value,
+            or function returning the replacement of a value.
+            message (str): String representing the log line.
+            value (Pattern): Pattern matching a field value.
+
+        Returns:
+            str: The obfuscated log message.
+        """
+        pieces = []
+        last = 0
+        equal = message.find("=")
+        while equal != -1:
+            if self.match_start(message, equal, last) == -1:
+                equal = message.find("=", equal + 1)
+                continue
+            pieces.append(message[last:equal + 1])
+            last = value.match(message, equal + 1).end()
+            if callable(redaction):
+                pieces.append(redaction(message[equal + 1:last]))
+            else:
+                pieces.append(redaction)
+            equal = message.find("=", last)
+        if not pieces:
+            return message
+        pieces.append(message[last:])
+        return "".join(pieces)
+
+
+class RedactionPlan:
+    """ Compiled redaction of a set of fields in a log line
+    """
+
+    def __init__(self, fields: Tuple[str, ...], redaction: str,
+                 separator: str, engine: str = "regex"):
+        """
+        Compile the pattern and replacement used to obfuscate fields.
+
+        Args:
+            fields (tuple): Field names to obfuscate.
+            redaction (str): String replacing each field value.
+            separator (str): Character separating fields in the log line.
+            engine (str): "regex" for a regex alternation of the fields,
+            "automaton" for a FieldScanner whose cost does not grow with
+            the number of fields. Both give the same result.
+        """
+        if engine not in ENGINES:
+            raise ValueError("engine must be one of {}".format(
+                ", ".join(ENGINES)))
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.needles = tuple("{}=".format(field) for field in self.fields)
+        escaped = [re.escape(field) for field in self.fields]
+        # Matches start on the "=" and look behind it for the field, so
+        # the replacement is a literal string that re substitutes without
+        # expanding a group template per match. A field holding "=", the
+        # separator or a line break could overlap the previous match, and
+        # keeps the capturing pattern.
+        if any(char in field for field in self.fields
+               for char in "=\r\n" + separator):
+            prefix = "({})=".format('|'.join(escaped))
+            self.replacement = "\\g<1>={}".format(
+                redaction.replace('\\', '\\\\'))
+        else:
+            prefix = "=(?:{})".format('|'.join(
+                "(?<={}=)".format(field) for field in escaped))
+            self.replacement = "={}".format(redaction.replace('\\',
+                                                              '\\\\'))
+        self.pattern = re.compile("{}[^{}]*".format(
+            prefix, re.escape(separator)))
+        self.lines_pattern = re.compile("{}[^{}\r\n]*".format(
+            prefix, re.escape(separator)))
+        self.value_pattern = re.compile("{}(?P<value>[^{}]*)".format(
+            prefix, re.escape(separator)))
+
+        # Fields holding "=" break the FieldScanner invariant
+        if any("=" in field for field in self.fields):
+            engine = "regex"
+        self.engine = engine
+        self.scanner = None
+        if engine == "automaton":
+            self.scanner = FieldScanner(self.fields)
+            self.value = re.compile("[^{}]*".format(re.escape(separator)))
+            self.lines_value = re.compile("[^{}\r\n]*".format(
+                re.escape(separator)))
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscate the plan fields in a log message.
+
+        Args:
+            message (str): String representing the log line.
+
+        Returns:
+            str: The obfuscated log message.
+        """
+        if self.scanner is not None:
+            return self.scanner.sub(self.redaction, message, self.value)
+        for needle in self.needles:
+            if needle in message:
+                return self.pattern.sub(self.replacement, message)
+        return message
+
+    def redact_lines(self, text: str) -> str:
+        """
+        Obfuscate the plan fields in a block of several log lines.
+
+        Values never run past the end of their line, so the result is the
+        same as redacting each line on its own.
+
+        Args:
+            text (str): Log lines separated by newlines.
+
+        Returns:
+            str: The obfuscated log lines.
+        """
+        if self.scanner is not None:
+            return self.scanner.sub(self.redaction, text, self.lines_value)
+        for needle in self.needles:
+            if needle in text:
+                return self.lines_pattern.sub(self.replacement, text)
+        return text
+
+    def pseudonymize(self, message: str,
+                     tokens: Callable[[str], str]) -> str:
+        """
+        Replace the value of the plan fields by their token.
+
+        Args:
+            message (str): String representing the log line.
+            tokens (callable): Function returning the token of a value.
+
+        Returns:
+            str: The pseudonymized log message.
+        """
+        if self.scanner is not None:
+            return self.scanner.sub(tokens, message, self.value)
+        for needle in self.needles:
+            if needle in message:
+                return self.value_pattern.sub(
+                    lambda match: match.string[match.start():
+                                               match.start("value")]
+                    + tokens(match.group("value")), message)
+        return message
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _cached_plan(fields: Tuple[str, ...], redaction: str,
+                 separator: str, engine: str) -> RedactionPlan:
+    """ Build the plan of a hashable (fields, redaction, separator) key
+    """
+    return RedactionPlan(fields, redaction, separator, engine)
+
+
+def get_redaction_plan(fields: List[str], redaction: str,
+                       separator: str,
+                       engine: str = "regex") -> RedactionPlan:
+    """
+    Returns the compiled redaction plan for the given parameters.
+
+    Plans are cached with LRU eviction, so repeated calls with the same
+    fields, redaction, separator and engine reuse the same compiled plan.
+
+    Args:
+        fields (list): List of strings representing
+        all fields to obfuscate.
+        redaction (str): String representing by what
+        the field will be obfuscated.
+        separator (str): String representing by which character
+        is separating all fields in the log line.
+        engine (str): Scanner engine, "regex" or "automaton".
+
+    Returns:
+        RedactionPlan: The compiled plan.
+    """
+    return _cached_plan(tuple(fields), redaction, separator, engine)
 
 
 def filter_datum(fields: List[str], redaction: str,
-                 message: str, separator: str) -> str:
+                 message: str, separator: str,
+                 engine: str = "regex") -> str:
     """
     Obfuscates specified fields in a log message.
 
@@ -22,13 +290,181 @@ def filter_datum(fields: List[str], redaction: str,
         message (str): String representing the log line.
         separator (str): String representing by which character
         is separating all fields in the log line.
+        engine (str): "regex" or "automaton", the latter scales to long
+        field lists.
 
     Returns:
         str: The obfuscated log message.
     """
-    pattern = f"({'|'.join(fields)})=[^{separator}]*"
-    return re.sub(pattern,
-                  lambda m: f"{m.group().split('=')[0]}={redaction}", message)
+    plan = get_redaction_plan(fields, redaction, separator, engine)
+    return plan.redact(message)
+
+
+def _ordered_map(function: Callable, items: Iterable,
+                 workers: int) -> Iterator:
+    """ Apply a function to items across a process pool, in item order
+
+    At most two items per worker are in flight, so items are pulled from
+    the iterable lazily. With 1 worker the function runs in this process.
+    """
+    if workers == 1:
+        for item in items:
+            yield function(item)
+        return
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def _redact_batch(fields: Tuple[str, ...], redaction: str, separator: str,
+                  engine: str, messages: List[str]) -> List[str]:
+    """ Redact a list of messages, run in the worker processes
+
+    Messages without line breaks are joined into one text so the whole
+    batch is redacted by a single substitution.
+    """
+    plan = get_redaction_plan(fields, redaction, separator, engine)
+    if None not in messages:
+        text = "\n".join(messages)
+        if "\r" not in text and text.count("\n") == len(messages) - 1:
+            return plan.redact_lines(text).split("\n")
+    return [message if message is None else plan.redact(message)
+            for message in messages]
+
+
+def _batches(messages: Iterable[str], size: int) -> Iterator[List[str]]:
+    """ Split an iterable of messages into lists of at most size messages
+    """
+    messages = iter(messages)
+    batch = list(islice(messages, size))
+    while batch:
+        yield batch
+        batch = list(islice(messages, size))
+
+
+def filter_data(fields: List[str], redaction: str, messages: Iterable[str],
+                separator: str, engine: str = "regex",
+                batch_size: int = BATCH_SIZE, workers: int = 1):
+    """
+    Obfuscates specified fields in many log messages.
+
+    The result has the container type of the messages: a list or tuple
+    for a list or tuple, a NumPy or pyarrow array for an array of strings
+    and a lazy iterator for any other iterable.
+
+    Args:
+        fields (list): List of strings representing
+        all fields to obfuscate.
+        redaction (str): String representing by what
+        the field will be obfuscated.
+        messages (iterable): Log lines to obfuscate.
+        separator (str): String representing by which character
+        is separating all fields in the log line.
+        engine (str): Scanner engine, "regex" or "automaton".
+        batch_size (int): Number of messages redacted together.
+        workers (int): Number of worker processes, 1 redacts the batches
+        in this process.
+
+    Returns:
+        The obfuscated log messages.
+    """
+    # Compiled now so a bad engine raises before the lazy iteration starts
+    get_redaction_plan(fields, redaction, separator, engine)
+    redact = partial(_redact_batch, tuple(fields), redaction, separator,
+                     engine)
+
+    def redacted(items: Iterable[str]) -> Iterator[str]:
+        for batch in _ordered_map(redact, _batches(items, batch_size),
+                                  workers):
+            yield from batch
+
+    if isinstance(messages, (list, tuple)):
+        return type(messages)(redacted(messages))
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(messages, numpy.ndarray):
+        dtype = object if messages.dtype == object else None
+        return numpy.array(list(redacted(messages.tolist())), dtype=dtype)
+    pyarrow = sys.modules.get("pyarrow")
+    if pyarrow is not None and isinstance(messages, pyarrow.Array):
+        return pyarrow.array(list(redacted(messages.to_pylist())),
+                             type=messages.type)
+    if pyarrow is not None and isinstance(messages, pyarrow.ChunkedArray):
+        return pyarrow.chunked_array([list(redacted(messages.to_pylist()))],
+                                     type=messages.type)
+    return redacted(messages)
+
+
+class Pseudonymizer:
+    """ Keyed HMAC tokens of field values
+
+    The same value always gives the same token for a given key, so logs
+    can be correlated without holding the value. Tokens are memoized in
+    a bounded LRU cache, as the same users show up over and over.
+    """
+
+    def __init__(self, key: bytes, cache_size: int = TOKEN_CACHE_SIZE):
+        """
+        Initialize the pseudonymizer with its secret key.
+
+        Args:
+            key (bytes): Secret HMAC key.
+            cache_size (int): Maximum number of memoized tokens.
+        """
+        self.key = key
+        self.token = lru_cache(maxsize=cache_size)(self._token)
+        self.pattern = re.compile("hmac:[0-9a-f]{{{}}}".format(TOKEN_LENGTH))
+
+    def _token(self, value: str) -> str:
+        """ Compute the token of a value
+        """
+        digest = hmac.new(self.key, value.encode('utf-8', 'surrogateescape'),
+                          hashlib.sha256).hexdigest()
+        return "hmac:{}".format(digest[:TOKEN_LENGTH])
+
+    def retoken(self, value: str) -> str:
+        """
+        Returns the token of a value, or the value itself when it already
+        is a token, so a message scanned twice is tokenized once.
+        """
+        if self.pattern.fullmatch(value):
+            return value
+        return self.token(value)
+
+    def hit_rate(self) -> float:
+        """
+        Returns the share of tokens served from the cache.
+        """
+        info = self.token.cache_info()
+        calls = info.hits + info.misses
+        return info.hits / calls if calls else 0.0
+
+
+def _has_mapping_args(record: logging.LogRecord) -> bool:
+    """ Tell whether the record arguments are a mapping
+
+    LogRecord keeps positional arguments as a tuple and mapping ones
+    are nearly always a dict, which are checked first because isinstance
+    against the Mapping ABC is slower.
+    """
+    args = record.args
+    if type(args) is dict:
+        return bool(args)
+    return bool(args) and not isinstance(args, tuple) \
+        and isinstance(args, Mapping)
+
+
+def _copy_record(record: logging.LogRecord) -> logging.LogRecord:
+    """ Copy a record without LogRecord.__init__, which reads the clock
+    and the current thread and process
+    """
+    copy = logging.LogRecord.__new__(type(record))
+    copy.__dict__.update(record.__dict__)
+    return copy
 
 
 class RedactingFormatter(logging.Formatter):
@@ -39,16 +475,29 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], structured: bool = False,
+                 engine: str = "regex", pseudonymizer: Pseudonymizer = None):
         """
         Initialize the formatter with specified fields to obfuscate.
 
         Args:
             fields (list): List of strings representing
             all fields to obfuscate.
+            structured (bool): Redact the fields from mapping arguments
+            and `extra` attributes of the record before formatting, and
+            only scan the message when the arguments are not a mapping.
+            engine (str): Scanner engine, "regex" or "automaton".
+            pseudonymizer (Pseudonymizer): Replace values with their token
+            instead of the redaction string.
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.structured = structured
+        self.attributes = tuple(field for field in fields
+                                if field not in RECORD_ATTRIBUTES)
+        self.plan = get_redaction_plan(fields, self.REDACTION,
+                                       self.SEPARATOR, engine)
+        self.pseudonymizer = pseudonymizer
 
     def format(self, record: logging.LogRecord) -> str:
         """
@@ -60,30 +509,892 @@ class RedactingFormatter(logging.Formatter):
         Returns:
             str: The formatted log record with obfuscated fields.
         """
+        if self.structured:
+            return super().format(
+                self.redact_traceback(self.redact_record(record)))
         original_message = super().format(record)
-        return filter_datum(self.fields, self.REDACTION,
-                            original_message, self.SEPARATOR)
+        return self.redact(original_message, self.record_plan(record))
+
+    def record_plan(self, record: logging.LogRecord) -> RedactionPlan:
+        """
+        Returns the plan redacting a record, which also covers the
+        EXPORT_FIELDS attribute that export_users sets on its rows.
+        """
+        fields = getattr(record, EXPORT_FIELDS, None)
+        if not fields:
+            return self.plan
+        return get_redaction_plan(
+            list(self.fields) + [field for field in fields
+                                 if field not in self.fields],
+            self.REDACTION, self.SEPARATOR, self.plan.engine)
+
+    def redact(self, message: str, plan: RedactionPlan = None) -> str:
+        """
+        Obfuscate the fields of a message with the redaction string or,
+        with a pseudonymizer, with the token of each value.
+        """
+        if plan is None:
+            plan = self.plan
+        if self.pseudonymizer is None:
+            return plan.redact(message)
+        return plan.pseudonymize(message, self.pseudonym)
+
+    def pseudonym(self, value: str) -> str:
+        """
+        Returns the token of a field value, keeping values already
+        redacted, as by export_users, or already tokens as they are.
+        """
+        if value == self.REDACTION:
+            return value
+        return self.pseudonymizer.retoken(value)
+
+    def redact_text(self, text: str) -> str:
+        """
+        Obfuscate the fields of a block of several lines, each value
+        ending at the end of its line.
+        """
+        if self.pseudonymizer is None:
+            return self.plan.redact_lines(text)
+        return "\n".join(self.redact(line) for line in text.split("\n"))
+
+    def redact_value(self, value) -> str:
+        """
+        Returns what replaces a field value held by a record.
+        """
+        if self.pseudonymizer is None:
+            return self.REDACTION
+        return self.pseudonymizer.token(str(value))
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        """
+        Scan the message alone in structured mode, after the arguments
+        were redacted by key, for the fields written in its text.
+        """
+        if self.structured:
+            record.message = self.redact(record.message,
+                                         self.record_plan(record))
+        return super().formatMessage(record)
+
+    def redact_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Obfuscate the fields found in mapping arguments and record
+        attributes, without modifying the record seen by other handlers.
+
+        Args:
+            record (logging.LogRecord): The log record to redact.
+
+        Returns:
+            logging.LogRecord: The record itself when it holds none of the
+            fields, otherwise a redacted copy.
+        """
+        args = record.args
+        if _has_mapping_args(record):
+            keys = [field for field in self.fields if field in args]
+        else:
+            keys = []
+        attributes = [attribute for attribute in self.attributes
+                      if attribute in record.__dict__]
+        if not keys and not attributes:
+            return record
+
+        redacted = _copy_record(record)
+        if keys:
+            redacted.args = dict(args)
+            for key in keys:
+                redacted.args[key] = self.redact_value(args[key])
+        for attribute in attributes:
+            setattr(redacted, attribute,
+                    self.redact_value(getattr(record, attribute)))
+        return redacted
+
+    def redact_traceback(self, record: logging.LogRecord) -> \
+            logging.LogRecord:
+        """
+        Obfuscate the fields in the exception and stack text that
+        Formatter.format appends after the message in structured mode.
+
+        Args:
+            record (logging.LogRecord): The log record to redact.
+
+        Returns:
+            logging.LogRecord: The record itself when it holds no
+            exception or stack, otherwise a redacted copy.
+        """
+        if not (record.exc_info or record.exc_text or record.stack_info):
+            return record
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self.formatException(record.exc_info)
+        redacted = _copy_record(record)
+        if exc_text:
+            redacted.exc_text = self.redact_text(exc_text)
+        if record.stack_info:
+            redacted.stack_info = self.redact_text(record.stack_info)
+        return redacted
+
+
+class RateLimitFilter(logging.Filter):
+    """ Logger filter sampling and rate limiting records per level
+
+    Attached to the logger, it drops records before any handler formats
+    them. For each level, `samples` keeps that share of the records and
+    `rates` applies a token bucket of (records per second, burst). Every
+    `summary_seconds`, a WARNING record tells how many records were
+    suppressed since the previous summary. A timer thread, started on the
+    first suppressed record, sends it even when no record follows, and
+    close sends the last one, which happens at exit.
+    """
+
+    def __init__(self, rates: Dict[int, Tuple[float, int]] = None,
+                 samples: Dict[int, float] = None,
+                 summary_seconds: float = SUMMARY_SECONDS):
+        """
+        Initialize the filter with its per level limits.
 
+        Args:
+            rates (dict): Level number to (records per second, burst).
+            samples (dict): Level number to the share of records kept,
+            between 0 and 1.
+            summary_seconds (float): Interval between summary records.
+        """
+        super(RateLimitFilter, self).__init__()
+        self.rates = dict(rates or {})
+        self.samples = dict(samples or {})
+        self.summary_seconds = summary_seconds
+        now = time.monotonic()
+        self.buckets = {level: [float(burst), now]
+                        for level, (rate, burst) in self.rates.items()}
+        self.credits = {level: 0.0 for level in self.samples}
+        self.suppressed = {}
+        self.summary_at = now + summary_seconds
+        self.lock = threading.Lock()
+        self.name = None
+        self.timer = None
+        self.closed = threading.Event()
+
+    def _allow(self, level: int, now: float) -> bool:
+        """ Apply the sample share then the token bucket of a level
+        """
+        share = self.samples.get(level)
+        if share is not None:
+            self.credits[level] += share
+            if self.credits[level] < 1:
+                return False
+            self.credits[level] -= 1
+        bucket = self.buckets.get(level)
+        if bucket is not None:
+            rate, burst = self.rates[level]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+        return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Tell whether the record is logged, emitting a summary of the
+        suppressed records when one is due.
+
+        Args:
+            record (logging.LogRecord): The record to check.
+
+        Returns:
+            bool: True if the record is logged.
+        """
+        if getattr(record, "suppressed_summary", False):
+            return True
+        with self.lock:
+            self.name = record.name
+            now = time.monotonic()
+            keep = self._allow(record.levelno, now)
+            if not keep:
+                self.suppressed[record.levelno] = \
+                    self.suppressed.get(record.levelno, 0) + 1
+                if self.timer is None:
+                    self._start_timer()
+            summary = self._take_summary(now)
+        if summary:
+            self._emit_summary(record.name, summary)
+        return keep
+
+    def _start_timer(self):
+        """ Start the thread sending the summaries, under the lock
+        """
+        self.timer = threading.Thread(target=self._run_timer, daemon=True)
+        self.timer.start()
+        atexit.register(self.close)
+
+    def _run_timer(self):
+        """ Send each summary when due until the filter is closed
+        """
+        while not self.closed.wait(
+                max(0.0, self.summary_at - time.monotonic())):
+            self.summarize()
+
+    def _take_summary(self, now: float, force: bool = False) -> \
+            Dict[int, int]:
+        """ Take the suppressed counts if a summary is due, under the
+        lock
+        """
+        if not force and now < self.summary_at:
+            return None
+        self.summary_at = now + self.summary_seconds
+        summary, self.suppressed = self.suppressed, {}
+        return summary
+
+    def summarize(self, force: bool = False):
+        """
+        Send the summary of the suppressed records if one is due.
+
+        Args:
+            force (bool): Send it now, whatever the time.
+        """
+        with self.lock:
+            summary = self._take_summary(time.monotonic(), force)
+            name = self.name
+        if summary:
+            self._emit_summary(name, summary)
+
+    def close(self):
+        """
+        Stop the timer and send the summary of the records suppressed
+        since the previous one.
+        """
+        self.closed.set()
+        self.summarize(True)
+
+    def _emit_summary(self, name: str, suppressed: Dict[int, int]):
+        """ Log how many records of each level were suppressed
+        """
+        logger = logging.getLogger(name)
+        details = ", ".join("{}: {}".format(logging.getLevelName(level),
+                                            count)
+                            for level, count in sorted(suppressed.items()))
+        logger.handle(logger.makeRecord(
+            name, logging.WARNING, __file__, 0,
+            "%d messages suppressed (%s)",
+            (sum(suppressed.values()), details), None,
+            extra={"suppressed_summary": True}))
+
+
+class BlockingQueueListener(QueueListener):
+    """ Queue listener that waits for room in a full bounded queue to
+    enqueue its stop sentinel, which QueueListener puts without waiting
+    """
+
+    def enqueue_sentinel(self):
+        """
+        Put the stop sentinel after every queued record.
+        """
+        self.queue.put(self._sentinel)
+
+
+class RedactingQueueHandler(QueueHandler):
+    """ Queue handler that only enqueues records on the logging thread
+
+    Formatting and redaction are left to the QueueListener thread. When the
+    bounded queue is full, the overflow policy decides what happens:
+    "block" waits for room, "drop_oldest" discards the oldest queued record
+    and "drop" discards the new record. Discarded records are counted in
+    `dropped`.
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "block"):
+        """
+        Initialize the handler with a bounded queue and overflow policy.
+
+        Args:
+            log_queue (queue.Queue): Bounded queue shared with the listener.
+            overflow (str): One of OVERFLOW_POLICIES.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+        super(RedactingQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Enqueue the record untouched, the listener formats it.
+        """
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Put the record on the queue following the overflow policy.
+
+        Args:
+            record (logging.LogRecord): The record to enqueue.
+        """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == "drop":
+                    return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def close(self):
+        """
+        Stop the listener after it has handled every queued record.
+        """
+        if self.listener is not None:
+            listener, self.listener = self.listener, None
+            listener.stop()
+        super(RedactingQueueHandler, self).close()
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """ File handler writing formatted records in large batches
+
+    Records are buffered in memory and written with a single write once
+    `capacity` records are waiting, `flush_ms` milliseconds have passed,
+    or a record at `flush_level` or above arrives. The file is rotated
+    once it reaches `max_bytes` or every `rotate_seconds`; rotated
+    segments are gzipped by a background thread so the logging thread
+    never waits on compression, and only the `backup_count` newest are
+    kept.
+    """
+
+    def __init__(self, file_path: str, capacity: int = BUFFER_CAPACITY,
+                 flush_ms: int = FLUSH_MS, max_bytes: int = 0,
+                 rotate_seconds: int = 0, backup_count: int = 0,
+                 flush_level: int = logging.ERROR):
+        """
+        Open the log file and start the timed flusher.
+
+        Args:
+            file_path (str): Path of the active log file.
+            capacity (int): Number of records buffered before a flush.
+            flush_ms (int): Longest time in milliseconds a record waits
+            in the buffer.
+            max_bytes (int): Rotate once the file reaches this size,
+            0 disables size rotation.
+            rotate_seconds (int): Rotate after this many seconds,
+            0 disables time rotation.
+            backup_count (int): Number of compressed segments kept,
+            0 keeps them all.
+            flush_level (int): Records at this level or above are
+            flushed at once.
+        """
+        super(BufferedRotatingFileHandler, self).__init__()
+        self.file_path = os.path.abspath(file_path)
+        self.capacity = capacity
+        self.flush_ms = flush_ms
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.flush_level = flush_level
+        self.buffer = []
+        self.stream = open(self.file_path, 'a', encoding='utf-8')
+        self.rollover_at = self._next_rollover()
+        self.compressor = ThreadPoolExecutor(max_workers=1)
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically,
+                                        daemon=True)
+        self.flusher.start()
+
+    def _next_rollover(self) -> float:
+        """ Time of the next time based rotation
+        """
+        if not self.rotate_seconds:
+            return float("inf")
+        return time.time() + self.rotate_seconds
+
+    def _flush_periodically(self):
+        """ Flush the buffer every flush_ms until the handler is closed
+        """
+        while not self.closed.wait(self.flush_ms / 1000):
+            self.flush()
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Format the record into the buffer, flushing when it is full.
+
+        Args:
+            record (logging.LogRecord): The record to write.
+        """
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.capacity \
+                or record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records in one write and rotate if needed.
+        """
+        with self.lock:
+            if self.stream is None:
+                return
+            if self.buffer:
+                self.buffer.append("")
+                self.stream.write("\n".join(self.buffer))
+                self.buffer = []
+                self.stream.flush()
+            if (self.max_bytes and self.stream.tell() >= self.max_bytes) \
+                    or time.time() >= self.rollover_at:
+                self.rotate()
+
+    def rotate(self):
+        """
+        Close the active file, rename it to a timestamped segment and
+        queue its compression.
+        """
+        with self.lock:
+            self.stream.close()
+            segment = "{}.{}".format(self.file_path,
+                                     time.strftime("%Y%m%d-%H%M%S"))
+            suffix = 0
+            while os.path.exists(segment) or \
+                    os.path.exists(segment + ".gz"):
+                suffix += 1
+                segment = "{}.{}-{}".format(self.file_path,
+                                            time.strftime("%Y%m%d-%H%M%S"),
+                                            suffix)
+            os.rename(self.file_path, segment)
+            self.stream = open(self.file_path, 'a', encoding='utf-8')
+            self.rollover_at = self._next_rollover()
+            self.compressor.submit(self._compress, segment)
+
+    def _compress(self, segment: str):
+        """ Gzip a rotated segment and drop the oldest ones
+        """
+        with open(segment, 'rb') as source, \
+                gzip.open(segment + ".gz.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+        os.replace(segment + ".gz.tmp", segment + ".gz")
+        os.remove(segment)
+        if not self.backup_count:
+            return
+        directory, name = os.path.split(self.file_path)
+        segments = sorted(
+            (entry for entry in os.listdir(directory)
+             if entry.startswith(name + ".") and entry.endswith(".gz")),
+            key=lambda entry: os.path.getmtime(os.path.join(directory,
+                                                            entry)))
+        for entry in segments[:-self.backup_count]:
+            os.remove(os.path.join(directory, entry))
+
+    def close(self):
+        """
+        Flush the buffer, wait for pending compressions and close the file.
+        """
+        self.closed.set()
+        self.flush()
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        self.compressor.shutdown(wait=True)
+        super(BufferedRotatingFileHandler, self).close()
 
-def get_logger() -> logging.Logger:
+
+class AggregatorHandler(RedactingQueueHandler):
+    """ Queue handler shipping raw records to a LogAggregator process
+
+    Records are made picklable and put on the multiprocessing queue of
+    the aggregator, which formats, redacts and writes them. The worker
+    only pays for the enqueue and never waits on disk.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Copy the record in a picklable form: positional arguments are
+        merged into the message and exceptions into their text.
+        """
+        prepared = logging.LogRecord.__new__(type(record))
+        prepared.__dict__.update(record.__dict__)
+        if not _has_mapping_args(record):
+            prepared.msg = record.getMessage()
+            prepared.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                prepared.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            prepared.exc_info = None
+        return prepared
+
+
+def _aggregate(log_queue: multiprocessing.Queue, file_path: str,
+               structured: bool, pseudonym_key: bytes, batch_size: int,
+               file_options: dict):
+    """ Writer process of a LogAggregator
+
+    Drains up to batch_size records at a time, redacts them with a
+    RedactingFormatter and writes the batch with a single write, or hands
+    it to a BufferedRotatingFileHandler, until the None sentinel.
+    """
+    pseudonymizer = None
+    if pseudonym_key is not None:
+        pseudonymizer = Pseudonymizer(pseudonym_key)
+    formatter = RedactingFormatter(PII_FIELDS, structured,
+                                   pseudonymizer=pseudonymizer)
+    handler = None
+    if file_path is not None:
+        handler = BufferedRotatingFileHandler(file_path, **file_options)
+        handler.setFormatter(formatter)
+
+    running = True
+    while running:
+        batch = [log_queue.get()]
+        while len(batch) < batch_size:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            running = False
+            batch = batch[:batch.index(None)]
+        if handler is not None:
+            for record in batch:
+                handler.handle(record)
+        elif batch:
+            sys.stderr.write("".join(formatter.format(record) + "\n"
+                                     for record in batch))
+            sys.stderr.flush()
+    if handler is not None:
+        handler.close()
+
+
+class LogAggregator:
+    """ Single writer process for the logs of several worker processes
+
+    Start it in the parent before forking the workers, then have each
+    worker call get_logger(aggregator=aggregator.queue). Records from all
+    workers are redacted and written by the aggregator alone, so writes
+    never interleave or contend.
+    """
+
+    def __init__(self, file_path: str = None, structured: bool = False,
+                 pseudonym_key: bytes = None, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BUFFER_CAPACITY, **file_options):
+        """
+        Create the queue and the writer process.
+
+        Args:
+            file_path (str): Log file written by the aggregator, defaults
+            to the standard error stream.
+            structured (bool): Structured mode of the RedactingFormatter.
+            pseudonym_key (bytes): Replace values with HMAC tokens.
+            queue_size (int): Maximum number of records waiting.
+            batch_size (int): Maximum number of records written together.
+            file_options: Options of BufferedRotatingFileHandler.
+        """
+        self.queue = multiprocessing.Queue(queue_size)
+        self.process = multiprocessing.Process(
+            target=_aggregate, name="log-aggregator", daemon=True,
+            args=(self.queue, file_path, structured, pseudonym_key,
+                  batch_size, file_options))
+
+    def start(self):
+        """
+        Start the writer process.
+        """
+        self.process.start()
+
+    def stop(self):
+        """
+        Write every queued record and stop the writer process.
+        """
+        self.queue.put(None)
+        self.process.join()
+
+
+def get_logger(queued: bool = False,
+               queue_size: int = QUEUE_SIZE,
+               overflow: str = "block",
+               structured: bool = False,
+               file_path: str = None,
+               rates: Dict[int, Tuple[float, int]] = None,
+               samples: Dict[int, float] = None,
+               pseudonym_key: bytes = None,
+               aggregator: multiprocessing.Queue = None,
+               **file_options) -> logging.Logger:
     """
     Creates and configures a logger.
 
+    In queued mode the logger only enqueues records; a QueueListener
+    thread redacts them and writes them to the stream. The listener is
+    flushed and stopped when the handler is closed, which logging does
+    at interpreter exit.
+
+    With a file path, records go to a BufferedRotatingFileHandler rather
+    than to the stream. Rates or samples attach a RateLimitFilter to the
+    logger, so suppressed records are never formatted. With the queue of
+    a LogAggregator, records are shipped unformatted to its process.
+
+    Args:
+        queued (bool): Use a QueueHandler instead of a StreamHandler.
+        queue_size (int): Maximum number of records waiting in the queue.
+        overflow (str): Policy applied when the queue is full, one of
+        "block", "drop_oldest" or "drop".
+        structured (bool): Redact mapping arguments and extra attributes
+        before formatting instead of scanning the formatted line.
+        file_path (str): Log file written instead of the stream.
+        rates (dict): Level number to (records per second, burst).
+        samples (dict): Level number to the share of records kept.
+        pseudonym_key (bytes): Replace values with HMAC tokens under
+        this key instead of the redaction string.
+        aggregator (multiprocessing.Queue): Queue of a LogAggregator
+        receiving the records.
+        file_options: Buffering and rotation options of
+        BufferedRotatingFileHandler.
+
     Returns:
         logging.Logger: Configured logger object.
     """
     logger = logging.getLogger("user_data")
     logger.setLevel(logging.INFO)
     logger.propagate = False
+    if rates or samples:
+        logger.addFilter(RateLimitFilter(rates, samples))
+
+    if aggregator is not None:
+        logger.addHandler(AggregatorHandler(aggregator, overflow))
+        return logger
 
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter(PII_FIELDS)
+    if file_path is None:
+        stream_handler = logging.StreamHandler()
+    else:
+        stream_handler = BufferedRotatingFileHandler(file_path,
+                                                     **file_options)
+    pseudonymizer = None
+    if pseudonym_key is not None:
+        pseudonymizer = Pseudonymizer(pseudonym_key)
+    formatter = RedactingFormatter(PII_FIELDS, structured,
+                                   pseudonymizer=pseudonymizer)
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(stream_handler)
+    if not queued:
+        logger.addHandler(stream_handler)
+        return logger
+
+    queue_handler = RedactingQueueHandler(queue.Queue(queue_size), overflow)
+    queue_handler.listener = BlockingQueueListener(
+        queue_handler.queue, stream_handler, respect_handler_level=True)
+    queue_handler.listener.start()
+    logger.addHandler(queue_handler)
 
     return logger
 
 
+def _redact_chunk(fields: Tuple[str, ...], redaction: str, separator: str,
+                  engine: str, chunk: bytes) -> bytes:
+    """ Redact a chunk of whole log lines, run in the worker processes
+    """
+    plan = get_redaction_plan(fields, redaction, separator, engine)
+    text = chunk.decode('utf-8', 'surrogateescape')
+    return plan.redact_lines(text).encode('utf-8', 'surrogateescape')
+
+
+def read_line_chunks(file: BinaryIO,
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reads a binary file in chunks that end on a line boundary.
+
+    Args:
+        file (BinaryIO): File opened in binary mode.
+        chunk_size (int): Approximate size in bytes of each chunk.
+
+    Returns:
+        Iterator[bytes]: Chunks of whole lines, in file order.
+    """
+    remainder = b""
+    while True:
+        block = file.read(chunk_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            remainder = block
+            continue
+        remainder = block[cut:]
+        yield block[:cut]
+    if remainder:
+        yield remainder
+
+
+def redact_files(file_paths: List[str], output: BinaryIO,
+                 fields: List[str] = PII_FIELDS, redaction: str = "***",
+                 separator: str = ";", workers: int = None,
+                 chunk_size: int = CHUNK_SIZE,
+                 engine: str = "regex") -> int:
+    """
+    Redacts log files chunk by chunk across a pool of processes.
+
+    Chunks are written to the output in input order. At most two chunks
+    per worker are in flight, so memory use does not depend on the size
+    of the input files.
+
+    Args:
+        file_paths (list): Paths of the log files to redact.
+        output (BinaryIO): Binary stream receiving the redacted lines.
+        fields (list): Fields to obfuscate.
+        redaction (str): String replacing each field value.
+        separator (str): Character separating fields in a log line.
+        workers (int): Number of worker processes, defaults to the number
+        of CPUs. With 1 worker the redaction runs in this process.
+        chunk_size (int): Approximate size in bytes of each chunk.
+        engine (str): Scanner engine, "regex" or "automaton".
+
+    Returns:
+        int: Number of bytes read from the input files.
+    """
+    redact = partial(_redact_chunk, tuple(fields), redaction, separator,
+                     engine)
+    sizes = []
+
+    def chunks():
+        for file_path in file_paths:
+            with open(file_path, 'rb') as f:
+                for chunk in read_line_chunks(f, chunk_size):
+                    sizes.append(len(chunk))
+                    yield chunk
+
+    for redacted in _ordered_map(redact, chunks(),
+                                 workers or os.cpu_count() or 1):
+        output.write(redacted)
+    return sum(sizes)
+
+
+def get_db() -> Connection:
+    """
+    Connects to the personal data database.
+
+    The PERSONAL_DATA_DB_PATH environment variable selects a local SQLite
+    database file. Otherwise the MySQL database is reached with
+    PERSONAL_DATA_DB_USERNAME, PERSONAL_DATA_DB_PASSWORD,
+    PERSONAL_DATA_DB_HOST and PERSONAL_DATA_DB_NAME.
+
+    Returns:
+        Connection: A DB-API connection to the database.
+    """
+    db_path = os.getenv("PERSONAL_DATA_DB_PATH")
+    if db_path is not None:
+        return sqlite3.connect(db_path)
+
+    import mysql.connector
+    return mysql.connector.connect(
+        user=os.getenv("PERSONAL_DATA_DB_USERNAME", "root"),
+        password=os.getenv("PERSONAL_DATA_DB_PASSWORD", ""),
+        host=os.getenv("PERSONAL_DATA_DB_HOST", "localhost"),
+        database=os.getenv("PERSONAL_DATA_DB_NAME"))
+
+
+def export_users(db: Connection, logger: logging.Logger,
+                 batch_size: int = BATCH_SIZE) -> int:
+    """
+    Logs every row of the users table in filtered format.
+
+    Rows are streamed with fetchmany from an unbuffered cursor, formatted
+    as "key=value; " pairs and redacted a batch at a time with
+    filter_data, so memory use does not depend on the table size. Columns
+    matching PII_FIELDS case-insensitively, such as "ssn" for "SSN", are
+    redacted too, and set in the EXPORT_FIELDS attribute of each record
+    so the formatter of the logger checks them again.
+
+    Args:
+        db (Connection): Connection returned by get_db.
+        logger (logging.Logger): Logger receiving one record per row.
+        batch_size (int): Number of rows fetched and redacted together.
+
+    Returns:
+        int: Number of rows logged.
+    """
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM users;")
+    columns = [column[0] for column in cursor.description]
+    template = "; ".join("{}={{}}".format(column) for column in columns)
+    template += ";"
+    pii = {field.lower() for field in PII_FIELDS}
+    extra = {EXPORT_FIELDS: tuple(column for column in columns
+                                  if column.lower() in pii)}
+    fields = list(PII_FIELDS) + [column for column in extra[EXPORT_FIELDS]
+                                 if column not in PII_FIELDS]
+    count = 0
+    rows = cursor.fetchmany(batch_size)
+    while rows:
+        lines = filter_data(fields, RedactingFormatter.REDACTION,
+                            [template.format(*row) for row in rows],
+                            RedactingFormatter.SEPARATOR,
+                            batch_size=batch_size)
+        for line in lines:
+            logger.info(line, extra=extra)
+        count += len(rows)
+        rows = cursor.fetchmany(batch_size)
+    cursor.close()
+    return count
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    Command line entry point.
+
+    Without arguments, logs the rows of the users table in filtered
+    format. With log files, redacts them.
+
+    Args:
+        argv (list): Command line arguments, defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields from the users table or log files")
+    parser.add_argument("files", nargs="*", help="log files to redact")
+    parser.add_argument("-o", "--output",
+                        help="output file, defaults to stdout")
+    parser.add_argument("-f", "--fields", nargs="+", default=PII_FIELDS,
+                        help="fields to obfuscate")
+    parser.add_argument("-r", "--redaction",
+                        default=RedactingFormatter.REDACTION)
+    parser.add_argument("-s", "--separator",
+                        default=RedactingFormatter.SEPARATOR)
+    parser.add_argument("-w", "--workers", type=int,
+                        help="worker processes, defaults to the CPU count")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="chunk size in bytes")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="regex",
+                        help="field scanner engine")
+    args = parser.parse_args(argv)
+
+    if not args.files:
+        logger = get_logger()
+        db = get_db()
+        start = time.perf_counter()
+        count = export_users(db, logger)
+        elapsed = time.perf_counter() - start
+        db.close()
+        print("Filtered {} rows in {:.3f}s ({:.0f} rows/s)".format(
+            count, elapsed, count / elapsed if elapsed else 0),
+            file=sys.stderr)
+        return
+
+    if args.output is None:
+        redact_files(args.files, sys.stdout.buffer, args.fields,
+                     args.redaction, args.separator, args.workers,
+                     args.chunk_size, args.engine)
+        sys.stdout.buffer.flush()
+        return
+    with open(args.output, 'wb') as output:
+        redact_files(args.files, output, args.fields, args.redaction,
+                     args.separator, args.workers, args.chunk_size,
+                     args.engine)
+
+
 if __name__ == '__main__':
     main()
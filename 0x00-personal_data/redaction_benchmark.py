@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the redaction strategies of filtered_logger
+
+Usage:
+    ./redaction_benchmark.py [--quick] [--save FILE] [--compare FILE]
+                             [--threshold RATIO]
+
+Each case redacts synthetic log lines and reports lines/sec and ns/line.
+`--save` writes the results as a JSON baseline, `--compare` exits with
+status 1 when a case is slower than the baseline by more than the
+threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+import filtered_logger
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_data,
+                             filter_datum, get_logger)
+
+OTHER_FIELDS = ("ip", "user_agent", "last_login", "country", "plan")
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Returns a field list of the given size holding the PII fields.
+    """
+    extra = ["field_{}".format(i) for i in range(count - len(PII_FIELDS))]
+    return list(PII_FIELDS) + extra
+
+
+def make_lines(count: int, pairs: int, density: float, separator: str,
+               seed: int = 0) -> List[str]:
+    """
+    Returns synthetic key=value log lines.
+
+    Args:
+        count (int): Number of lines.
+        pairs (int): Number of key=value pairs per line.
+        density (float): Share of the pairs holding a PII field.
+        separator (str): Separator between the pairs.
+        seed (int): Seed of the random generator.
+    """
+    rand = random.Random(seed)
+    lines = []
+    for i in range(count):
+        pairs_list = []
+        for j in range(pairs):
+            fields = PII_FIELDS if rand.random() < density else OTHER_FIELDS
+            pairs_list.append("{}={}{}".format(rand.choice(fields),
+                                               "v" * rand.randint(4, 24), j))
+        lines.append(separator.join(pairs_list) + separator)
+    return lines
+
+
+def measure(function: Callable, lines: int, repeat: int = 3) -> Dict:
+    """
+    Runs function `repeat` times and keeps the best time.
+
+    Returns:
+        dict: lines/sec and ns/line of the best run.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"lines_per_sec": round(lines / best),
+            "ns_per_line": round(best * 1e9 / lines)}
+
+
+def redaction_cases(count: int) -> Dict[str, Dict]:
+    """
+    Benchmarks filter_datum, filter_data and RedactingFormatter.format.
+    """
+    results = {}
+    shapes = [(pairs, density, separator, size)
+              for pairs in (4, 32)
+              for density in (0.0, 0.5)
+              for separator in (";", "|")
+              for size in (5, 500)]
+    for pairs, density, separator, size in shapes:
+        lines = make_lines(count, pairs, density, separator)
+        fields = make_fields(size)
+        shape = "pairs={} density={} sep={} fields={}".format(
+            pairs, density, separator, size)
+        for engine in filtered_logger.ENGINES:
+            results["filter_datum {} {}".format(engine, shape)] = measure(
+                lambda: [filter_datum(fields, "***", line, separator, engine)
+                         for line in lines], count)
+            results["filter_data {} {}".format(engine, shape)] = measure(
+                lambda: filter_data(fields, "***", lines, separator, engine),
+                count)
+
+    lines = make_lines(count, 8, 0.5, ";")
+    records = [logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                 line, None, None) for line in lines]
+    mappings = [logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                  "user %(email)s from %(ip)s",
+                                  ({"email": "bob@hbtn.io", "ip": "1.2"},),
+                                  None) for _ in lines]
+    for structured in (False, True):
+        formatter = RedactingFormatter(PII_FIELDS, structured)
+        name = "format structured={}".format(structured)
+        results[name + " message"] = measure(
+            lambda: [formatter.format(record) for record in records], count)
+        results[name + " mapping"] = measure(
+            lambda: [formatter.format(record) for record in mappings], count)
+    return results
+
+
+def logging_cases(count: int) -> Dict[str, Dict]:
+    """
+    Benchmarks logging from several threads through get_logger().
+
+    The handlers write to os.devnull, so the numbers show the cost of
+    redaction and of the handler lock rather than of the terminal.
+    """
+    results = {}
+    lines = make_lines(count, 8, 0.5, ";")
+    stderr = sys.stderr
+    for queued in (False, True):
+        for threads in (1, 4, 16):
+            with open(os.devnull, 'w') as devnull:
+                sys.stderr = devnull
+                try:
+                    logger = get_logger(queued=queued)
+                finally:
+                    sys.stderr = stderr
+                per_thread = lines[:count // threads]
+
+                def work():
+                    for line in per_thread:
+                        logger.info(line)
+
+                def run():
+                    workers = [threading.Thread(target=work)
+                               for _ in range(threads)]
+                    for worker in workers:
+                        worker.start()
+                    for worker in workers:
+                        worker.join()
+
+                name = "get_logger queued={} threads={}".format(
+                    queued, threads)
+                results[name] = measure(run, len(per_thread) * threads, 1)
+                for handler in list(logger.handlers):
+                    handler.close()
+                    logger.removeHandler(handler)
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            threshold: float) -> List[str]:
+    """
+    Returns the cases slower than the baseline by more than threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["ns_per_line"]
+        after = result["ns_per_line"]
+        if after > before * (1 + threshold):
+            regressions.append("{}: {} ns/line -> {} ns/line".format(
+                name, before, after))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Runs the benchmarks and returns the process exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer lines per case")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown ratio, default 0.2")
+    args = parser.parse_args(argv)
+
+    count = 2000 if args.quick else 20000
+    results = redaction_cases(count)
+    results.update(logging_cases(count))
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        print("{:<{}} {:>12,} lines/s {:>9,} ns/line".format(
+            name, width, result["lines_per_sec"], result["ns_per_line"]))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
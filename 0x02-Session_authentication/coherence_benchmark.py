@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+""" Benchmark of the multi-process coherence of the Base store
+
+Usage:
+    ./coherence_benchmark.py [users] [changes]
+
+Reports the cost of User.get with and without coherent when nothing
+changed, then the time a process takes to see the changes another
+process saved, for the snapshot and the journal storage.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from models.base import DATA, get_storage
+from models.user import User
+
+
+def populate(count: int):
+    """ Create count users and write them to file
+    """
+    DATA["User"] = {}
+    User.reset_indexes()
+    for i in range(count):
+        user = User(email="user{}@hbtn.io".format(i))
+        DATA["User"][user.id] = user
+        User.index(user)
+    User.save_to_file()
+    if User.journaled:
+        get_storage("json").journal(User).load()
+
+
+def get_cost(user_id: str, calls: int) -> float:
+    """ Return the microseconds per User.get call
+    """
+    start = time.perf_counter()
+    for _ in range(calls):
+        User.get(user_id)
+    return (time.perf_counter() - start) * 1e6 / calls
+
+
+def writer(user_ids: list, ready):
+    """ Change the first name of users from another process
+    """
+    User.load_from_file()
+    ready.wait()
+    for user_id in user_ids:
+        user = User.get(user_id)
+        user.first_name = "Changed"
+        user.save()
+
+
+def propagation(user_ids: list) -> float:
+    """ Return the seconds until this process sees the writer's changes
+    """
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=writer, args=(user_ids, ready))
+    process.start()
+    ready.set()
+    start = time.perf_counter()
+    process.join()
+    while User.get(user_ids[-1]).first_name != "Changed":
+        time.sleep(0.001)
+    changed = sum(1 for user_id in user_ids
+                  if User.get(user_id).first_name == "Changed")
+    assert changed == len(user_ids)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    changes = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for journaled in (False, True):
+                User.journaled = journaled
+                populate(users)
+                User.load_from_file()
+                user_ids = list(DATA["User"].keys())[:changes]
+                print("journaled={}".format(journaled))
+                for coherent in (False, True):
+                    User.coherent = coherent
+                    print("    get coherent={:<5} {:>8.2f} us/call".format(
+                        str(coherent), get_cost(user_ids[0], 100000)))
+                print("    {} changes seen after {:.3f} s".format(
+                    changes, propagation(user_ids)))
+                User.coherent = False
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" Benchmark of the bulk construction and import of users
+
+Usage:
+    ./import_benchmark.py [count]
+
+Builds count users from records with User(**record) and with
+User.from_records, then imports them with a single write and loads
+them back from file.
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+from models.base import DATA
+from models.user import User
+
+
+def make_records(count: int) -> list:
+    """ Return the records of count synthetic users, created over a day
+    """
+    return [{"id": "{:08d}-0000-4000-8000-000000000000".format(i),
+             "created_at": "2024-01-01T{:02d}:{:02d}:{:02d}".format(
+                 i // 3600 % 24, i // 60 % 60, i % 60),
+             "updated_at": "2024-06-01T12:30:00",
+             "email": "user{}@hbtn.io".format(i),
+             "_password": "0" * 64,
+             "first_name": "First{}".format(i),
+             "last_name": "Last{}".format(i)}
+            for i in range(count)]
+
+
+def timed(label: str, count: int, function):
+    """ Run function, print its time and rate, return its result
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print("{:<28} {:>8.2f} s {:>12,.0f} users/s".format(
+        label, elapsed, count / elapsed))
+    return result
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    records = make_records(count)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            User.load_from_file()
+            timed("User(**record)", count,
+                  lambda: [User(**record) for record in records])
+            timed("User.from_records", count,
+                  lambda: User.from_records(records))
+            timed("from_records save=True", count,
+                  lambda: User.from_records(records, save=True))
+            del records
+            DATA["User"] = {}
+            timed("load_from_file", count, User.load_from_file)
+            assert User.count() == count
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+""" Report the memory taken by each User
+
+Usage:
+    ./memory_benchmark.py [count]
+
+Compares a per-instance __dict__ layout, as User had before __slots__,
+with the slotted User storing datetimes and epoch seconds.
+"""
+import gc
+import sys
+import tracemalloc
+from datetime import datetime
+from models.user import User
+
+
+class DictUser():
+    """ User with the attributes in a per-instance __dict__
+    """
+
+    def __init__(self, i: int):
+        """ Initialize the attributes as User did before __slots__
+        """
+        self.id = "{:08d}-0000-4000-8000-000000000000".format(i)
+        self.created_at = datetime(2024, 1, 1, 0, 0, i % 60)
+        self.updated_at = datetime(2024, 6, 1, 12, 30, i % 60)
+        self.email = "user{}@hbtn.io".format(i)
+        self._password = "0" * 64
+        self.first_name = "First{}".format(i)
+        self.last_name = "Last{}".format(i)
+
+
+def make_user(i: int) -> User:
+    """ Return a User with the same attributes as DictUser(i)
+    """
+    user = User(id="{:08d}-0000-4000-8000-000000000000".format(i),
+                created_at=datetime(2024, 1, 1, 0, 0, i % 60),
+                updated_at=datetime(2024, 6, 1, 12, 30, i % 60),
+                email="user{}@hbtn.io".format(i),
+                _password="0" * 64,
+                first_name="First{}".format(i),
+                last_name="Last{}".format(i))
+    return user
+
+
+def bytes_per_user(make, count: int) -> float:
+    """ Return the traced bytes allocated per object built by make
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / count
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    baseline = bytes_per_user(DictUser, count)
+    print("{:<16} {:>8.0f} bytes/user".format("__dict__", baseline))
+    for epoch in (False, True):
+        User.epoch_timestamps = epoch
+        size = bytes_per_user(make_user, count)
+        print("{:<16} {:>8.0f} bytes/user {:>6.1%}".format(
+            "__slots__ epoch" if epoch else "__slots__", size,
+            size / baseline))
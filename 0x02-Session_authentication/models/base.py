@@ -1,40 +1,587 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import TypeVar, List, Iterable, Callable
+import gc
 import json
+import os
+import threading
+import time
 import uuid
+import zlib
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+LOCKS = {}
+STORAGES = {}
+EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_SLOTS = {"created_at": "_created_at", "updated_at": "_updated_at"}
+SLOT_ATTRIBUTES = {slot: field for field, slot in TIMESTAMP_SLOTS.items()}
+SORTED_CHUNK_SIZE = 1000
+_UNSET = object()
+
+
+def _to_datetime(value) -> datetime:
+    """ Parse a timestamp string or epoch seconds, datetimes are returned
+    as is
+    """
+    if type(value) is datetime:
+        return value
+    if type(value) is int:
+        return EPOCH + timedelta(seconds=value)
+    if len(value) == 19 and value[10] == "T":
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=65536)
+def _format_timestamp(value) -> str:
+    """ Format a datetime or epoch seconds, each distinct value once
+    """
+    if type(value) is int:
+        return time.strftime(TIMESTAMP_FORMAT, time.gmtime(value))
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+@lru_cache(maxsize=None)
+def _field_slots(cls: type) -> tuple:
+    """ Return the (field, slot, is a timestamp) of each json_fields
+    attribute of a class
+    """
+    return tuple((field, TIMESTAMP_SLOTS.get(field, field),
+                  field in TIMESTAMP_SLOTS) for field in cls.json_fields)
+
+
+def _json_default(value):
+    """ Serialize the datetimes of pickle snapshot records to JSON
+    """
+    if type(value) is datetime:
+        return value.strftime(TIMESTAMP_FORMAT)
+    raise TypeError("{} is not JSON serializable".format(type(value)))
+
+
+def shard_of(obj_id: str, shards: int) -> int:
+    """ Return the shard number of an object ID
+    """
+    return zlib.crc32(obj_id.encode()) % shards
+
+
+class HashIndex():
+    """ Hash index of the object IDs of a class on one attribute
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.entries = {}
+        self.values = {}
+
+    def add(self, obj_id: str, value):
+        """ Index an object ID, moving it if its value changed
+
+        The new entry is added before the old one is removed, so a
+        lookup without the writer lock always finds the object
+        """
+        old = self.values.get(obj_id, _UNSET)
+        if old is not _UNSET and old == value:
+            return
+        try:
+            self.entries.setdefault(value, {})[obj_id] = None
+        except TypeError:
+            self.discard(obj_id)
+            return
+        self.values[obj_id] = value
+        if old is not _UNSET:
+            self.remove_entry(old, obj_id)
+
+    def discard(self, obj_id: str):
+        """ Remove an object ID from the index
+        """
+        if obj_id not in self.values:
+            return
+        self.remove_entry(self.values.pop(obj_id), obj_id)
+
+    def remove_entry(self, value, obj_id: str):
+        """ Remove an object ID from the entry of a value
+        """
+        obj_ids = self.entries[value]
+        del obj_ids[obj_id]
+        if len(obj_ids) == 0:
+            del self.entries[value]
+
+    def add_many(self, pairs: Iterable[tuple]):
+        """ Index (object ID, value) pairs
+        """
+        for obj_id, value in pairs:
+            self.add(obj_id, value)
+
+    def lookup(self, value) -> Iterable[str]:
+        """ Return the object IDs indexed under value
+        """
+        try:
+            return list(self.entries.get(value, {}))
+        except TypeError:
+            return None
+
+    def lookup_range(self, value_range: TypeVar('Range')) -> Iterable[str]:
+        """ Return None, a hash index cannot find ranges
+        """
+        return None
+
+
+class Range():
+    """ Range of values matched by Base.search, bounds of None are open
+
+    Base.search({"created_at": Range(start, end)}) returns the objects
+    created between start and end, both included by default.
+    """
+
+    def __init__(self, low=None, high=None, include_low: bool = True,
+                 include_high: bool = True):
+        """ Initialize a range
+        """
+        self.low = low
+        self.high = high
+        self.include_low = include_low
+        self.include_high = include_high
+
+    def map(self, convert: Callable) -> TypeVar('Range'):
+        """ Return the range with both bounds converted
+        """
+        return Range(None if self.low is None else convert(self.low),
+                     None if self.high is None else convert(self.high),
+                     self.include_low, self.include_high)
+
+    def matches(self, value) -> bool:
+        """ Return True if value is in the range
+        """
+        if value is None:
+            return False
+        if self.low is not None and (value < self.low if self.include_low
+                                     else value <= self.low):
+            return False
+        if self.high is not None and (value > self.high if self.include_high
+                                      else value >= self.high):
+            return False
+        return True
+
+
+class SortedIndex():
+    """ Sorted index of the object IDs of a class on one attribute
+
+    sorted holds the chunks of parallel key and ID arrays kept in key
+    order with bisect, and the last key of each chunk, so a range or a
+    value is found in O(log n). A change copies a single chunk of at
+    most 2 * SORTED_CHUNK_SIZE entries and the list of chunks, then
+    replaces the pair at once, so a lookup without the writer lock never
+    sees it half done. None values are left out.
+    """
+
+    def __init__(self, attribute: str, convert: Callable = None):
+        """ Initialize an empty index on attribute, convert turns values
+        into keys
+        """
+        self.attribute = attribute
+        self.convert = convert
+        self.sorted = ([], [])
+        self.values = {}
+
+    def key(self, value):
+        """ Return the key of a value
+        """
+        if value is None or self.convert is None:
+            return value
+        return self.convert(value)
+
+    def add(self, obj_id: str, value):
+        """ Index an object ID, moving it if its value changed
+        """
+        key = self.key(value)
+        old = self.values.get(obj_id, _UNSET)
+        if (old is _UNSET and key is None) or old == key:
+            return
+        maxes, chunks = list(self.sorted[0]), list(self.sorted[1])
+        if old is not _UNSET:
+            self.remove_entry(maxes, chunks, old, obj_id)
+            del self.values[obj_id]
+        if key is not None:
+            self.insert_entry(maxes, chunks, key, obj_id)
+            self.values[obj_id] = key
+        self.sorted = (maxes, chunks)
+
+    @staticmethod
+    def remove_entry(maxes: list, chunks: list, key, obj_id: str):
+        """ Remove an entry from copies of the chunk lists
+        """
+        c = bisect_left(maxes, key)
+        while True:
+            keys, ids = chunks[c]
+            try:
+                i = ids.index(obj_id, bisect_left(keys, key),
+                              bisect_right(keys, key))
+                break
+            except ValueError:
+                c += 1
+        if len(keys) == 1:
+            del maxes[c]
+            del chunks[c]
+            return
+        keys, ids = keys[:i] + keys[i + 1:], ids[:i] + ids[i + 1:]
+        chunks[c] = (keys, ids)
+        maxes[c] = keys[-1]
+
+    @staticmethod
+    def insert_entry(maxes: list, chunks: list, key, obj_id: str):
+        """ Insert an entry in copies of the chunk lists, splitting a
+        chunk grown past 2 * SORTED_CHUNK_SIZE
+        """
+        if len(chunks) == 0:
+            maxes.append(key)
+            chunks.append(([key], [obj_id]))
+            return
+        c = min(bisect_right(maxes, key), len(chunks) - 1)
+        keys, ids = list(chunks[c][0]), list(chunks[c][1])
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        ids.insert(i, obj_id)
+        if len(keys) <= 2 * SORTED_CHUNK_SIZE:
+            chunks[c] = (keys, ids)
+            maxes[c] = keys[-1]
+            return
+        half = len(keys) // 2
+        chunks[c:c + 1] = [(keys[:half], ids[:half]),
+                           (keys[half:], ids[half:])]
+        maxes[c:c + 1] = [keys[half - 1], keys[-1]]
+
+    def add_many(self, pairs: Iterable[tuple]):
+        """ Index (object ID, value) pairs with a single sort
+        """
+        keys = [key for chunk in self.sorted[1] for key in chunk[0]]
+        ids = [obj_id for chunk in self.sorted[1] for obj_id in chunk[1]]
+        moved = []
+        for obj_id, value in pairs:
+            if obj_id in self.values:
+                moved.append((obj_id, value))
+                continue
+            key = self.key(value)
+            if key is not None:
+                keys.append(key)
+                ids.append(obj_id)
+                self.values[obj_id] = key
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        chunks = []
+        for start in range(0, len(order), SORTED_CHUNK_SIZE):
+            part = order[start:start + SORTED_CHUNK_SIZE]
+            chunks.append(([keys[i] for i in part], [ids[i] for i in part]))
+        self.sorted = ([chunk[0][-1] for chunk in chunks], chunks)
+        for obj_id, value in moved:
+            self.add(obj_id, value)
+
+    def discard(self, obj_id: str):
+        """ Remove an object ID from the index
+        """
+        self.add(obj_id, None)
+
+    def lookup(self, value) -> Iterable[str]:
+        """ Return the object IDs indexed under value
+        """
+        return self.lookup_range(Range(value, value))
+
+    def lookup_range(self, value_range: Range) -> Iterable[str]:
+        """ Return the object IDs with a value in a range, in value order
+        """
+        if value_range.low is None and value_range.high is None:
+            return None
+        maxes, chunks = self.sorted
+        low = bisect_left if value_range.include_low else bisect_right
+        high = bisect_right if value_range.include_high else bisect_left
+        result = []
+        try:
+            value_range = value_range.map(self.key)
+            c = 0
+            if value_range.low is not None:
+                c = low(maxes, value_range.low)
+            for c in range(c, len(chunks)):
+                keys, ids = chunks[c]
+                start, end = 0, len(keys)
+                if value_range.low is not None:
+                    start = low(keys, value_range.low)
+                if value_range.high is not None:
+                    end = high(keys, value_range.high)
+                result.extend(ids[start:end])
+                if end < len(keys):
+                    break
+        except (TypeError, ValueError):
+            return None
+        return result
+
+
+class ShardIndex(HashIndex):
+    """ Index of the object IDs of a class by shard number
+    """
+
+    def __init__(self, shards: int):
+        """ Initialize an empty index over shards shards
+        """
+        super().__init__("id")
+        self.shards = shards
+
+    def add(self, obj_id: str, value):
+        """ Index an object ID under its shard
+        """
+        if obj_id not in self.values:
+            super().add(obj_id, shard_of(obj_id, self.shards))
+
+
+class Storage(ABC):
+    """ Storage engine of the objects of Base classes
+
+    The engine in use is chosen by the STORAGE_ENGINE environment
+    variable, see get_storage
+    """
+
+    @abstractmethod
+    def load(self, cls: type):
+        """ Load or open the stored objects of a class
+        """
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Store an object, replacing the object with the same ID
+        """
+
+    @abstractmethod
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Store objects of a class in one write
+        """
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object
+        """
+
+    @abstractmethod
+    def count(self, cls: type) -> int:
+        """ Count the objects of a class
+        """
+
+    @abstractmethod
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return the object of a class with an ID, or None
+        """
+
+    @abstractmethod
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects of a class with matching attributes
+        """
+
+
+def normalize_attributes(attributes: dict) -> dict:
+    """ Convert the bounds of timestamp ranges to datetimes
+    """
+    return {k: v.map(_to_datetime)
+            if k in TIMESTAMP_SLOTS and isinstance(v, Range) else v
+            for k, v in attributes.items()}
+
+
+def matches(value, expected) -> bool:
+    """ Return True if value equals expected, or is in it if a Range
+    """
+    if isinstance(expected, Range):
+        return expected.matches(value)
+    return value == expected
+
+
+def plan(indexes: dict, attributes: dict) -> List[str]:
+    """ Return the IDs matching every indexed attribute, or None if no
+    attribute can use an index
+
+    The smallest result is kept in order and filtered by the others.
+    """
+    results = []
+    for k, v in attributes.items():
+        index = indexes.get(k)
+        if index is None:
+            continue
+        if isinstance(v, Range):
+            obj_ids = index.lookup_range(v)
+        else:
+            obj_ids = index.lookup(v)
+        if obj_ids is not None:
+            results.append(obj_ids)
+    if len(results) == 0:
+        return None
+    results.sort(key=len)
+    others = [set(obj_ids) for obj_ids in results[1:]]
+    return [obj_id for obj_id in results[0]
+            if all(obj_id in obj_ids for obj_ids in others)]
+
+
+def get_storage(engine: str = None) -> Storage:
+    """ Return a storage engine, by default the one named by STORAGE_ENGINE
+
+    "json", the default, keeps the objects in memory and in files.
+    "sqlite" stores them in the SQLite database at STORAGE_SQLITE_PATH
+    """
+    if engine is None:
+        engine = os.getenv("STORAGE_ENGINE", "json")
+    storage = STORAGES.get(engine)
+    if storage is None:
+        if engine == "json":
+            from models.json_storage import JSONStorage
+            storage = JSONStorage()
+        elif engine == "sqlite":
+            from models.sqlite_storage import SQLiteStorage
+            storage = SQLiteStorage(os.getenv("STORAGE_SQLITE_PATH",
+                                              ".db.sqlite3"))
+        else:
+            raise ValueError("STORAGE_ENGINE must be json or sqlite")
+        storage = STORAGES.setdefault(engine, storage)
+    return storage
 
 
 class Base():
     """ Base class
+
+    Attributes live in __slots__. Timestamps are stored as datetimes, or
+    as epoch seconds when epoch_timestamps is set, and read as datetimes.
+    The output of to_json is cached until an attribute is assigned.
+
+    Changes to the objects of a class are serialized by its writer lock
+    and file writes by its file lock. Readers take no lock: they work on
+    a list copy of DATA, taken atomically, or on a single lookup.
+
+    With coherent set, every read first checks the signature of the
+    file, or the size of the journal, and applies the changes other
+    processes wrote since the last load.
+
+    search uses a hash index on each of indexed_attributes and a sorted
+    index, which also answers Range queries, on each of
+    sorted_attributes. Indexes cost memory per object and work on each
+    save that changes their value, so classes declare the ones they need.
+
+    With shards above 1, the snapshot is split by ID hash into shards
+    files: a save rewrites a single shard and the shards are read in
+    parallel. Journaled classes keep a single snapshot file.
+
+    Loading, saving and queries go through the engine of get_storage.
+    The storage attributes above only apply to the json engine of
+    models/json_storage.py.
     """
 
+    __slots__ = ('id', '_created_at', '_updated_at', '_json_cache')
+    json_fields = ('id', 'created_at', 'updated_at')
+    epoch_timestamps = False
+    indexed_attributes = ()
+    lazy_load = False
+    journaled = False
+    journal_compact_after = 10000
+    write_behind = False
+    write_behind_ms = 100
+    snapshot_format = "json"
+    coherent = False
+    sorted_attributes = ()
+    shards = 1
+    shard_workers = 4
+    shard_processes = False
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__.reset_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = _to_datetime(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = _to_datetime(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    @classmethod
+    def store_timestamp(cls, value: datetime):
+        """ Convert a timestamp to its stored form
+        """
+        if not cls.epoch_timestamps:
+            return _to_datetime(value)
+        if type(value) is int:
+            return value
+        return int((_to_datetime(value) - EPOCH).total_seconds())
+
+    @property
+    def created_at(self) -> datetime:
+        """ Getter of the creation time
+        """
+        return _to_datetime(self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation time
+        """
+        self._created_at = self.store_timestamp(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Getter of the last update time
+        """
+        return _to_datetime(self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update time
+        """
+        self._updated_at = self.store_timestamp(value)
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, drop the cached JSON and move a stored
+        object in the index of the attribute
+
+        The cache is dropped after the value is set, so a cache built
+        concurrently from the old value does not survive
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_json_cache', None)
+        indexes = INDEXES.get(type(self).__name__)
+        if indexes:
+            index = indexes.get(SLOT_ATTRIBUTES.get(name, name))
+            if index is not None:
+                self.reindex(index)
+
+    def reindex(self, index: TypeVar('HashIndex')):
+        """ Move the object in an index if it is stored
+        """
+        cls = type(self)
+        obj_id = getattr(self, 'id', None)
+        if dict.get(DATA.get(cls.__name__, {}), obj_id) is not self:
+            return
+        with cls.lock():
+            if dict.get(DATA[cls.__name__], obj_id) is self:
+                index.add(obj_id, getattr(self, index.attribute, None))
+
+    def stored_attributes(self) -> Iterable[tuple]:
+        """ Yield the name and stored value of each set attribute
+        """
+        for key, slot, _ in _field_slots(type(self)):
+            value = getattr(self, slot, _UNSET)
+            if value is not _UNSET:
+                yield key, value
+        yield from getattr(self, '__dict__', {}).items()
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -46,67 +593,208 @@ class Base():
 
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+
+        Returns a copy of the dictionary cached until an attribute is
+        assigned
+        """
+        return dict(self.cached_json(self.json_cache(), for_serialization))
+
+    def encoded_json(self) -> str:
+        """ Return the JSON text of to_json(True)
+
+        The cached dictionary is used if there is one, but none is kept,
+        so writing the file does not add a cache to every object
+        """
+        cache = getattr(self, '_json_cache', None)
+        result = None if cache is None else cache.get(True)
+        if result is None:
+            result = self.build_json(True)
+        return json.dumps(result, default=_json_default)
+
+    def json_cache(self) -> dict:
+        """ Return the JSON cache of the object, creating it if needed
+
+        Callers keep the returned dict: the slot can be reset to None by
+        another thread at any time
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
+    def cached_json(self, cache: dict, for_serialization: bool) -> dict:
+        """ Return the JSON dictionary held in cache, building it if needed
+        """
+        result = cache.get(for_serialization)
+        if result is None:
+            result = cache[for_serialization] = self.build_json(
+                for_serialization)
+        return result
+
+    def build_json(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary returned by to_json
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, slot, timestamp in _field_slots(type(self)):
             if not for_serialization and key[0] == '_':
                 continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
+            value = getattr(self, slot, _UNSET)
+            if value is _UNSET:
+                continue
+            if type(value) is datetime or (timestamp and type(value) is int):
+                value = _format_timestamp(value)
+            result[key] = value
+        for key, value in getattr(self, '__dict__', {}).items():
+            if for_serialization or key[0] != '_':
+                result[key] = _format_timestamp(value) \
+                    if type(value) is datetime else value
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def lock(cls) -> threading.RLock:
+        """ Return the writer lock of the class
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        lock = LOCKS.get(cls.__name__)
+        if lock is None:
+            lock = LOCKS.setdefault(cls.__name__, threading.RLock())
+        return lock
+
+    @classmethod
+    def reset_indexes(cls):
+        """ Create empty indexes on the indexed attributes
+        """
+        INDEXES[cls.__name__] = cls.new_indexes()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def new_indexes(cls) -> dict:
+        """ Return empty indexes on the indexed attributes, and on the
+        shard number when sharded
+        """
+        indexes = {attribute: HashIndex(attribute)
+                   for attribute in cls.indexed_attributes}
+        for attribute in cls.sorted_attributes:
+            indexes[attribute] = SortedIndex(
+                attribute, _to_datetime if attribute in TIMESTAMP_SLOTS
+                else None)
+        if cls.sharded():
+            indexes["_shard"] = ShardIndex(cls.shards)
+        return indexes
 
     @classmethod
-    def save_to_file(cls):
-        """ Save all objects to file
+    def sharded(cls) -> bool:
+        """ Return True if the snapshot is split in shard files
+        """
+        return cls.shards > 1 and not cls.journaled
+
+    @classmethod
+    def index(cls, obj: TypeVar('Base')):
+        """ Add or move an object in the indexes
+        """
+        for index in INDEXES.get(cls.__name__, {}).values():
+            index.add(obj.id, getattr(obj, index.attribute, None))
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict],
+                     save: bool = False) -> List[TypeVar('Base')]:
+        """ Build objects from their constructor arguments in one pass
+
+        Each json_fields attribute is set from its record, or None, so a
+        subclass whose __init__ does more must override this method. A
+        class that does not declare its own json_fields is built with
+        cls(**record), as its attributes are unknown. Each distinct
+        timestamp is parsed once and a missing one is the time of the
+        call. The garbage collector is paused while building as the new
+        objects form no cycles. With save, the objects are stored as they
+        are, timestamps included, with a single write
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        if DATA.get(s_class) is None:
+            DATA[s_class] = {}
+            cls.reset_indexes()
+        now = cls.store_timestamp(datetime.utcnow())
+        timestamps = {None: now}
+        fields = []
+        for field in cls.json_fields:
+            name = TIMESTAMP_SLOTS.get(field, field)
+            descriptor = getattr(cls, name, None)
+            if not hasattr(descriptor, "__set__"):
+                descriptor = None
+            fields.append((field, name, descriptor, field in TIMESTAMP_SLOTS))
+        objs = []
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if "json_fields" in cls.__dict__:
+                cls.build_records(records, fields, timestamps, objs)
+            else:
+                objs.extend(cls(**record) for record in records)
+        finally:
+            if collecting:
+                gc.enable()
+        if save:
+            get_storage().save_many(cls, objs)
+        return objs
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def build_records(cls, records: Iterable[dict], fields: list,
+                      timestamps: dict, objs: list):
+        """ Append the objects of records to objs, see from_records
+        """
+        new = cls.__new__
+        for record in records:
+            obj = new(cls)
+            for field, name, descriptor, timestamp in fields:
+                value = record.get(field)
+                if timestamp:
+                    stored = timestamps.get(value)
+                    if stored is None:
+                        stored = timestamps[value] = cls.store_timestamp(
+                            value)
+                    value = stored
+                elif field == "id" and "id" not in record:
+                    value = str(uuid.uuid4())
+                if descriptor is None:
+                    object.__setattr__(obj, name, value)
+                else:
+                    descriptor.__set__(obj, value)
+            objs.append(obj)
+
+    @classmethod
+    def load_from_file(cls):
+        """ Load all objects from the storage engine
+        """
+        get_storage().load(cls)
+
+    @classmethod
+    def save_to_file(cls, durable: bool = False):
+        """ Save all objects to the files of the JSON storage engine
+        """
+        get_storage("json").save_to_file(cls, durable)
+
+    @classmethod
+    def flush(cls):
+        """ Write the pending write-behind changes of the JSON storage
+        engine now
+        """
+        get_storage("json").flush(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        get_storage().save(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        get_storage().remove(self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return get_storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -118,20 +806,10 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return get_storage().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return get_storage().search(cls, attributes)
@@ -0,0 +1,825 @@
+#!/usr/bin/env python3
+""" JSON storage engine module
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import TypeVar, List, Iterable, Callable, Tuple
+from os import path
+import atexit
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from models.base import (DATA, INDEXES, TIMESTAMP_SLOTS, Storage,
+                         _json_default, _to_datetime, matches,
+                         normalize_attributes, plan, shard_of)
+
+
+JOURNALS = {}
+FLUSHERS = {}
+FILE_LOCKS = {}
+SIGNATURES = {}
+PENDING_SHARDS = {}
+SNAPSHOT_FORMATS = ("json", "pickle")
+LOGGER = logging.getLogger(__name__)
+
+
+def read_snapshot(file_path: str) -> dict:
+    """ Read a snapshot file, pickle if its name ends with .pickle and
+    JSON otherwise
+
+    Returns the constructor arguments of each object by ID. Timestamps
+    are strings in JSON snapshots and datetimes in pickle snapshots.
+    """
+    if not path.exists(file_path):
+        return {}
+    with open(file_path, 'rb') as f:
+        if file_path.endswith(".pickle"):
+            return pickle.load(f)
+        return json.load(f)
+
+
+def write_snapshot(file_path: str, objs: dict, snapshot_format: str = "json",
+                   durable: bool = False):
+    """ Write the constructor arguments of objects by ID to a snapshot
+
+    Pickle snapshots use protocol 5 with timestamps kept as datetimes.
+    They are always written atomically: temporary file, fsync, rename.
+    A durable JSON snapshot is written the same way.
+    """
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError("snapshot format must be one of {}".format(
+            ", ".join(SNAPSHOT_FORMATS)))
+    if snapshot_format == "pickle":
+        write_file(file_path, pickle.dumps(objs, protocol=5), True)
+    else:
+        write_file(file_path, json.dumps(objs, default=_json_default).encode(),
+                   durable)
+
+
+def file_signature(file_path: str) -> tuple:
+    """ Return the inode, size and modification time of a file, or None
+    if it does not exist
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def write_file(file_path: str, data: bytes, durable: bool = False,
+               atomic: bool = False):
+    """ Write data to a file, atomically when atomic or durable, and
+    synced to disk when durable
+
+    An atomic write goes to a temporary file of this process renamed over
+    the file, so readers in other processes never see it half written.
+    """
+    if not durable and not atomic:
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def convert_snapshot(file_path: str, snapshot_format: str) -> str:
+    """ Rewrite a snapshot file in another format, under the extension of
+    that format, and return the new file path
+
+    Timestamps are parsed once here when converting to pickle.
+    """
+    objs = read_snapshot(file_path)
+    if snapshot_format == "pickle":
+        for obj in objs.values():
+            for key in TIMESTAMP_SLOTS:
+                if obj.get(key) is not None:
+                    obj[key] = _to_datetime(obj[key])
+    new_path = "{}.{}".format(path.splitext(file_path)[0], snapshot_format)
+    write_snapshot(new_path, objs, snapshot_format, durable=True)
+    if new_path != file_path:
+        os.remove(file_path)
+    return new_path
+
+
+def shard_paths(s_class: str, shards: int,
+                snapshot_format: str = "json") -> List[str]:
+    """ Return the snapshot files of a class split in shards files, a
+    single file for 1 shard or less, named after the snapshot format
+    """
+    if shards <= 1:
+        return [".db_{}.{}".format(s_class, snapshot_format)]
+    return [".db_{}.{}.{}".format(s_class, shard, snapshot_format)
+            for shard in range(shards)]
+
+
+def snapshot_files(s_class: str) -> List[str]:
+    """ Return the existing snapshot files of a class, single file and
+    shard files of every format alike
+    """
+    pattern = re.compile(r"\.db_{}(\.\d+)?\.({})$".format(
+        re.escape(s_class), "|".join(SNAPSHOT_FORMATS)))
+    return [name for name in os.listdir(".") if pattern.match(name)]
+
+
+def reshard(s_class: str, shards: int, snapshot_format: str = "json"):
+    """ Move the snapshot files of a class, in any format, to shards
+    files in snapshot_format
+
+    All new files are written and synced under temporary names before
+    any is renamed into place, then the files of the old layout are
+    removed. Run it while no process writes the class.
+    """
+    old_paths = snapshot_files(s_class)
+    objs = {}
+    for file_path in old_paths:
+        objs.update(read_snapshot(file_path))
+    new_paths = shard_paths(s_class, shards, snapshot_format)
+    parts = [{} for _ in new_paths]
+    for obj_id, obj in objs.items():
+        parts[shard_of(obj_id, len(new_paths))][obj_id] = obj
+    for file_path, part in zip(new_paths, parts):
+        write_snapshot(file_path + ".reshard", part, snapshot_format,
+                       durable=True)
+    for file_path in new_paths:
+        os.replace(file_path + ".reshard", file_path)
+    for file_path in old_paths:
+        if file_path not in new_paths:
+            os.remove(file_path)
+
+
+class LazyObjects(dict):
+    """ Objects of a class by ID, built from their record on first access
+
+    Values stay the constructor arguments read from the file until
+    they are read through the mapping, so loading builds no object and
+    len() never builds any. Objects are built under the writer lock of
+    the class, so a concurrent remove cannot be undone.
+    """
+
+    def __init__(self, cls: type, records: dict):
+        """ Initialize the mapping with the records of a class
+        """
+        super().__init__(records)
+        self.cls = cls
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return an object, building it from its record if needed
+        """
+        value = dict.__getitem__(self, obj_id)
+        if type(value) is dict:
+            with self.cls.lock():
+                value = dict.__getitem__(self, obj_id)
+                if type(value) is dict:
+                    value = self.cls(**value)
+                    dict.__setitem__(self, obj_id, value)
+        return value
+
+    def get(self, obj_id: str, default=None) -> TypeVar('Base'):
+        """ Return an object or default if the ID is unknown
+        """
+        try:
+            return self[obj_id]
+        except KeyError:
+            return default
+
+    def values(self) -> List[TypeVar('Base')]:
+        """ Return all objects, building the remaining ones
+        """
+        return [obj for obj_id, obj in self.items()]
+
+    def items(self) -> List[tuple]:
+        """ Return all (ID, object) pairs, building the remaining objects
+        """
+        items = []
+        for obj_id in list(self.keys()):
+            try:
+                items.append((obj_id, self[obj_id]))
+            except KeyError:
+                continue
+        return items
+
+
+class Journal():
+    """ Append-only log of the changes of a class since its snapshot
+
+    Each save or remove appends one JSON line. Once the journal holds
+    compact_after records it is renamed to a compacting segment, which a
+    background thread folds into the snapshot file.
+
+    The journal remembers the inode and the offset read up to, so the
+    records appended by other processes can be read with tail().
+    """
+
+    def __init__(self, s_class: str, compact_after: int,
+                 snapshot_format: str = "json"):
+        """ Initialize the journal of a class
+        """
+        self.snapshot_path = ".db_{}.{}".format(s_class, snapshot_format)
+        self.snapshot_format = snapshot_format
+        self.file_path = ".db_{}.journal".format(s_class)
+        self.compacting_path = self.file_path + ".compacting"
+        self.compact_after = compact_after
+        self.lock = threading.Lock()
+        self.file = None
+        self.count = 0
+        self.compactor = None
+        self.inode = None
+        self.offset = 0
+
+    def open(self):
+        """ Open the journal file for appending, reopening it if another
+        process rotated it
+        """
+        if self.file is not None:
+            signature = file_signature(self.file_path)
+            if signature is not None and \
+                    signature[0] == os.fstat(self.file.fileno()).st_ino:
+                return
+            self.file.close()
+        self.file = open(self.file_path, 'ab')
+        if self.inode is None:
+            self.inode = os.fstat(self.file.fileno()).st_ino
+
+    def append(self, record: dict):
+        """ Append a change record, starting a compaction when due
+        """
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[dict]):
+        """ Append change records with a single write and flush
+        """
+        lines = [json.dumps(record) + "\n" for record in records]
+        data = "".join(lines).encode()
+        with self.lock:
+            self.open()
+            self.file.write(data)
+            self.file.flush()
+            end = self.file.tell()
+            if self.offset == end - len(data) and \
+                    self.inode == os.fstat(self.file.fileno()).st_ino:
+                self.offset = end
+            self.count += len(lines)
+            if self.count >= self.compact_after and \
+                    (self.compactor is None or not self.compactor.is_alive()):
+                self.start_compaction()
+
+    def start_compaction(self):
+        """ Rotate the journal and fold it into the snapshot in background
+
+        A segment left over by an interrupted compaction is folded first.
+        """
+        if not path.exists(self.compacting_path):
+            self.file.close()
+            self.file = None
+            os.replace(self.file_path, self.compacting_path)
+            self.count = 0
+            self.inode = None
+            self.offset = 0
+        self.compactor = threading.Thread(target=self.compact, daemon=True)
+        self.compactor.start()
+
+    def compact(self):
+        """ Write snapshot plus compacting segment as the new snapshot
+        """
+        objs_json = read_snapshot(self.snapshot_path)
+        self.replay(self.compacting_path, objs_json)
+        with self.lock:
+            write_snapshot(self.snapshot_path, objs_json,
+                           self.snapshot_format, durable=True)
+            os.remove(self.compacting_path)
+
+    @staticmethod
+    def read_records(file_path: str, offset: int = 0) -> Tuple[list, int]:
+        """ Return the complete records of a journal file after offset,
+        and the offset following them
+        """
+        if not path.exists(file_path):
+            return [], offset
+        records = []
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                offset += len(line)
+        return records, offset
+
+    @staticmethod
+    def apply(records: list, objs_json: dict):
+        """ Apply change records to the JSON of objects by ID
+        """
+        for record in records:
+            if record["op"] == "save":
+                objs_json[record["id"]] = record["obj"]
+            else:
+                objs_json.pop(record["id"], None)
+
+    @staticmethod
+    def replay(file_path: str, objs_json: dict) -> int:
+        """ Apply the records of a journal file, return how many
+        """
+        records, _ = Journal.read_records(file_path)
+        Journal.apply(records, objs_json)
+        return len(records)
+
+    def load(self) -> dict:
+        """ Return the JSON of all objects: snapshot, segment, journal
+        """
+        with self.lock:
+            objs_json = read_snapshot(self.snapshot_path)
+            self.replay(self.compacting_path, objs_json)
+            signature = file_signature(self.file_path)
+            self.inode = signature[0] if signature is not None else None
+            records, self.offset = self.read_records(self.file_path)
+            if signature is not None and signature[1] > self.offset:
+                self.drop_torn_record()
+            self.apply(records, objs_json)
+            self.count = len(records)
+        return objs_json
+
+    def drop_torn_record(self):
+        """ Cut the journal after the last complete record when a crash
+        left the last line incomplete, as the records appended after it
+        would be unreadable
+        """
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            if b"\n" in f.read():
+                return
+        os.truncate(self.file_path, self.offset)
+
+    def tail(self) -> list:
+        """ Return the records appended since the last read, or None if
+        the journal file was replaced
+        """
+        with self.lock:
+            signature = file_signature(self.file_path)
+            if signature is None:
+                return [] if self.inode is None else None
+            if self.inode is None:
+                self.inode = signature[0]
+            elif signature[0] != self.inode or signature[1] < self.offset:
+                return None
+            if signature[1] == self.offset:
+                return []
+            records, self.offset = self.read_records(self.file_path,
+                                                     self.offset)
+        return records
+
+
+class Flusher():
+    """ Write-behind flusher coalescing the writes of a class
+
+    Changes only mark the class dirty. A background thread waits
+    window_ms after the first change, then writes every change made in
+    the window with a single durable save, so at most about window_ms of
+    changes can be lost. Pending changes are also flushed at exit. A
+    failed save is logged and retried one window later.
+    """
+
+    def __init__(self, save: Callable, window_ms: int):
+        """ Start the flusher thread of a save function
+        """
+        self.save = save
+        self.window_ms = window_ms
+        self.dirty = threading.Event()
+        self.lock = threading.Lock()
+        self.flushes = 0
+        self.errors = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        """ Flush one window after each first change
+        """
+        while True:
+            self.dirty.wait()
+            time.sleep(self.window_ms / 1000)
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception("write-behind flush failed")
+
+    def flush(self):
+        """ Write the pending changes now, if any, they stay pending if
+        the save fails
+        """
+        with self.lock:
+            if not self.dirty.is_set():
+                return
+            self.dirty.clear()
+            start = time.perf_counter()
+            try:
+                self.save()
+            except BaseException:
+                self.errors += 1
+                self.dirty.set()
+                raise
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_ms = elapsed
+            self.max_ms = max(self.max_ms, elapsed)
+            self.total_ms += elapsed
+
+    def stats(self) -> dict:
+        """ Return the flush count and latencies in milliseconds
+        """
+        return {"flushes": self.flushes,
+                "errors": self.errors,
+                "pending": self.dirty.is_set(),
+                "last_ms": self.last_ms,
+                "max_ms": self.max_ms,
+                "avg_ms": self.total_ms / self.flushes if self.flushes else 0}
+
+
+class JSONStorage(Storage):
+    """ Objects held in DATA and written to .db_<Class>.json files, or
+    .db_<Class>.pickle files in the pickle snapshot format
+
+    The files hold a JSON or pickle snapshot, optionally sharded or with
+    a journal, as set by the class attributes of Base
+    """
+
+    def load(self, cls: type):
+        """ Load all objects from file
+
+        In journaled mode, the journal is replayed over the snapshot. In
+        lazy_load mode, objects are only built when first read. Raises
+        ValueError if the files on disk were written for another number
+        of shards or in another snapshot format
+        """
+        s_class = cls.__name__
+        SIGNATURES[s_class] = self.signature(cls)
+        self.check_layout(cls)
+        if cls.journaled:
+            objs_json = self.journal(cls).load()
+        else:
+            objs_json = self.read_files(cls)
+
+        indexes = cls.new_indexes()
+        if cls.lazy_load:
+            objs = LazyObjects(cls, objs_json)
+            for index in indexes.values():
+                index.add_many((obj_id, obj_json.get(index.attribute))
+                               for obj_id, obj_json in objs_json.items())
+        else:
+            objs = dict(zip(objs_json.keys(),
+                            cls.from_records(objs_json.values())))
+            for index in indexes.values():
+                index.add_many((obj_id, getattr(obj, index.attribute, None))
+                               for obj_id, obj in objs.items())
+        with cls.lock():
+            DATA[s_class] = objs
+            INDEXES[s_class] = indexes
+
+    def save(self, obj: TypeVar('Base')):
+        """ Store an object and write it to the journal or the file
+        """
+        cls = obj.__class__
+        self.refresh(cls)
+        with cls.lock():
+            obj._json_cache = None
+            DATA[cls.__name__][obj.id] = obj
+            cls.index(obj)
+            if cls.journaled:
+                self.journal(cls).append(
+                    {"op": "save", "id": obj.id, "obj": obj.to_json(True)})
+                return
+        self.persist(cls, obj.id)
+
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Store objects and write them with a single journal append or
+        file write
+        """
+        s_class = cls.__name__
+        self.refresh(cls)
+        with cls.lock():
+            DATA[s_class].update((obj.id, obj) for obj in objs)
+            for index in INDEXES.get(s_class, {}).values():
+                index.add_many((obj.id, getattr(obj, index.attribute, None))
+                               for obj in objs)
+            if cls.journaled:
+                self.journal(cls).append_many(
+                    {"op": "save", "id": obj.id, "obj": obj.to_json(True)}
+                    for obj in objs)
+                return
+        self.persist(cls)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Remove an object and write it to the journal or the file
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        self.refresh(cls)
+        with cls.lock():
+            if obj.id not in DATA[s_class]:
+                return
+            del DATA[s_class][obj.id]
+            for index in INDEXES.get(s_class, {}).values():
+                index.discard(obj.id)
+            if cls.journaled:
+                self.journal(cls).append({"op": "remove", "id": obj.id})
+                return
+        self.persist(cls, obj.id)
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        self.refresh(cls)
+        return len(DATA[cls.__name__].keys())
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self.refresh(cls)
+        return DATA[cls.__name__].get(obj_id)
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        The IDs found by the indexes of the attributes are intersected,
+        and only those objects are checked, and built in lazy_load mode.
+        All objects are scanned when no attribute is indexed
+        """
+        s_class = cls.__name__
+        self.refresh(cls)
+        attributes = normalize_attributes(attributes)
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if not matches(getattr(obj, k), v):
+                    return False
+            return True
+
+        obj_ids = plan(INDEXES.get(s_class, {}), attributes)
+        if obj_ids is None:
+            return list(filter(_search, list(DATA[s_class].values())))
+        objs = DATA[s_class]
+        objs = [objs.get(obj_id) for obj_id in obj_ids]
+        return [obj for obj in objs if obj is not None and _search(obj)]
+
+    def file_lock(self, cls) -> threading.Lock:
+        """ Return the lock serializing the file writes of the class
+        """
+        lock = FILE_LOCKS.get(cls.__name__)
+        if lock is None:
+            lock = FILE_LOCKS.setdefault(cls.__name__, threading.Lock())
+        return lock
+
+    def file_paths(self, cls) -> List[str]:
+        """ Return the snapshot files of the class
+        """
+        return shard_paths(cls.__name__, cls.shards if cls.sharded() else 1,
+                           cls.snapshot_format)
+
+    def signature(self, cls) -> tuple:
+        """ Return the signatures of the snapshot files of the class
+        """
+        return tuple(file_signature(file_path)
+                     for file_path in self.file_paths(cls))
+
+    def check_layout(self, cls):
+        """ Raise ValueError if snapshot files of another number of shards
+        or another format exist, as they would be neither read nor
+        replaced
+        """
+        file_paths = self.file_paths(cls)
+        others = sorted(file_path for file_path in snapshot_files(cls.__name__)
+                        if file_path not in file_paths)
+        if others:
+            raise ValueError(
+                "{} expects {} but {} exist, run snapshot_tool.py reshard "
+                "{} {} {}".format(cls.__name__, ", ".join(file_paths),
+                                  ", ".join(others), cls.__name__,
+                                  len(file_paths), cls.snapshot_format))
+
+    def read_files(self, cls) -> dict:
+        """ Return the records of all objects, reading shards in parallel
+        threads, or processes with shard_processes
+        """
+        file_paths = self.file_paths(cls)
+        if len(file_paths) == 1:
+            return read_snapshot(file_paths[0])
+        executor = ProcessPoolExecutor if cls.shard_processes \
+            else ThreadPoolExecutor
+        objs_json = {}
+        with executor(cls.shard_workers) as pool:
+            for part in pool.map(read_snapshot, file_paths):
+                objs_json.update(part)
+        return objs_json
+
+    def journal(self, cls) -> Journal:
+        """ Return the journal of the class
+        """
+        s_class = cls.__name__
+        if JOURNALS.get(s_class) is None:
+            JOURNALS[s_class] = Journal(s_class, cls.journal_compact_after,
+                                        cls.snapshot_format)
+        return JOURNALS[s_class]
+
+    def save_to_file(self, cls, durable: bool = False,
+                     shards: Iterable = None):
+        """ Save all objects to file, in the snapshot_format of the class
+
+        A durable save writes a temporary file, syncs it to disk and
+        renames it over the previous file. A sharded class can write
+        only the given shard numbers
+        """
+        with self.file_lock(cls):
+            self.write_objects(cls, durable, shards)
+
+    def write_objects(self, cls, durable: bool, shards: Iterable = None):
+        """ Write a copy of the objects of the class to its files
+        """
+        s_class = cls.__name__
+        signature = self.signature(cls)
+        file_paths = self.file_paths(cls)
+        if not cls.sharded():
+            self.write_snapshot_of(cls, file_paths[0],
+                                   list(dict.items(DATA[s_class])), durable)
+        else:
+            objs = DATA[s_class]
+            shard_index = INDEXES[s_class]["_shard"]
+            for shard in range(cls.shards) if shards is None else shards:
+                pairs = [(obj_id, dict.get(objs, obj_id))
+                         for obj_id in shard_index.lookup(shard)]
+                self.write_snapshot_of(cls, file_paths[shard],
+                                       [pair for pair in pairs
+                                        if pair[1] is not None], durable)
+        if SIGNATURES.get(s_class) == signature:
+            SIGNATURES[s_class] = self.signature(cls)
+
+    def write_snapshot_of(self, cls, file_path: str, objs: list,
+                          durable: bool):
+        """ Write (ID, object) pairs to a snapshot file of the class,
+        atomically for a coherent class as other processes read it
+        """
+        if cls.snapshot_format == "json":
+            entries = []
+            for obj_id, obj in objs:
+                if type(obj) is dict:
+                    encoded = json.dumps(obj, default=_json_default)
+                else:
+                    encoded = obj.encoded_json()
+                entries.append("{}: {}".format(json.dumps(obj_id), encoded))
+            write_file(file_path, "{{{}}}".format(", ".join(entries)).encode(),
+                       durable, cls.coherent)
+            return
+        objs_json = {}
+        for obj_id, obj in objs:
+            if type(obj) is dict:
+                objs_json[obj_id] = obj
+            else:
+                objs_json[obj_id] = dict(obj.stored_attributes())
+        write_snapshot(file_path, objs_json, cls.snapshot_format, durable)
+
+    def refresh(self, cls):
+        """ Apply the changes other processes wrote since the last load
+
+        Only runs for coherent classes already loaded. When nothing
+        changed it costs one stat, two for a journaled class. A changed
+        journal is read from the last offset; a changed snapshot is read
+        whole, but only the objects whose record changed are rebuilt.
+
+        Writers append to the journal under the writer lock and write the
+        snapshot under the file lock, so a whole read under the same lock
+        neither mistakes a write of this process for another process's
+        nor drops an object saved but not yet written
+        """
+        s_class = cls.__name__
+        if not cls.coherent or s_class not in SIGNATURES:
+            return
+        if self.signature(cls) == SIGNATURES[s_class]:
+            if not cls.journaled:
+                return
+            records = self.journal(cls).tail()
+            if records is not None:
+                with cls.lock():
+                    for record in records:
+                        self.apply_record(cls, record["id"], record.get("obj"))
+                return
+        if cls.journaled:
+            with cls.lock():
+                SIGNATURES[s_class] = self.signature(cls)
+                self.apply_records(cls, self.journal(cls).load())
+            return
+        with self.file_lock(cls):
+            signature = self.signature(cls)
+            if signature == SIGNATURES[s_class]:
+                return
+            SIGNATURES[s_class] = signature
+            objs_json = self.read_files(cls)
+            with cls.lock():
+                self.apply_records(cls, objs_json)
+
+    def apply_records(self, cls, objs_json: dict):
+        """ Make the objects of the class match the records of all objects
+        """
+        for obj_id in list(dict.keys(DATA[cls.__name__])):
+            if obj_id not in objs_json:
+                self.apply_record(cls, obj_id, None)
+        for obj_id, obj_json in objs_json.items():
+            self.apply_record(cls, obj_id, obj_json)
+
+    def apply_record(self, cls, obj_id: str, obj_json: dict):
+        """ Store the record of an object unless it is unchanged, or
+        remove the object when obj_json is None
+        """
+        s_class = cls.__name__
+        objs = DATA[s_class]
+        indexes = INDEXES.get(s_class, {}).values()
+        obj = dict.get(objs, obj_id)
+        if obj_json is None:
+            if obj is not None:
+                dict.__delitem__(objs, obj_id)
+                for index in indexes:
+                    index.discard(obj_id)
+            return
+        if obj is not None and obj_json == (
+                obj if type(obj) is dict else obj.to_json(True)):
+            return
+        if type(objs) is LazyObjects:
+            dict.__setitem__(objs, obj_id, obj_json)
+            for index in indexes:
+                index.add(obj_id, obj_json.get(index.attribute))
+        else:
+            objs[obj_id] = cls(**obj_json)
+            cls.index(objs[obj_id])
+
+    def flusher(self, cls) -> Flusher:
+        """ Return the write-behind flusher of the class
+        """
+        s_class = cls.__name__
+        if FLUSHERS.get(s_class) is None:
+            FLUSHERS[s_class] = Flusher(partial(self.save_pending, cls),
+                                        cls.write_behind_ms)
+        return FLUSHERS[s_class]
+
+    def flush(self, cls):
+        """ Write the pending write-behind changes of the class now
+        """
+        if FLUSHERS.get(cls.__name__) is not None:
+            FLUSHERS[cls.__name__].flush()
+
+    def flush_stats(self, cls) -> dict:
+        """ Return the write-behind flush count and latencies
+        """
+        return self.flusher(cls).stats()
+
+    def persist(self, cls, obj_id: str = None):
+        """ Write the objects of the class after a change, only the shard
+        of obj_id when sharded
+        """
+        shards = None
+        if obj_id is not None and cls.sharded():
+            shards = {shard_of(obj_id, cls.shards)}
+        if not cls.write_behind:
+            self.save_to_file(cls, shards=shards)
+            return
+        with cls.lock():
+            pending = PENDING_SHARDS.setdefault(cls.__name__, set())
+            pending.update(shards if shards is not None else {None})
+        self.flusher(cls).dirty.set()
+
+    def save_pending(self, cls):
+        """ Write the shards changed since the last write-behind flush,
+        they stay pending if the write fails
+        """
+        shards = self.pending_shards(cls)
+        try:
+            self.save_to_file(cls, True, shards)
+        except BaseException:
+            with cls.lock():
+                pending = PENDING_SHARDS.setdefault(cls.__name__, set())
+                pending.update(shards if shards is not None else {None})
+            raise
+
+    def pending_shards(self, cls) -> Iterable[int]:
+        """ Take the shard numbers changed since the last write-behind
+        flush, None meaning all
+        """
+        with cls.lock():
+            pending = PENDING_SHARDS.pop(cls.__name__, set())
+        if None in pending:
+            return None
+        return sorted(pending)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+""" SQLite storage engine module
+"""
+from datetime import datetime
+from typing import List, TypeVar
+import sqlite3
+import threading
+from models.base import (TIMESTAMP_FORMAT, TIMESTAMP_SLOTS, Range, Storage,
+                         matches, normalize_attributes)
+
+
+def _quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _parameter(value, timestamp: bool = False):
+    """ Return the SQL parameter of a search value, or raise TypeError if
+    it cannot be compared in SQL like in Python
+
+    Timestamp columns hold strings but their attributes are datetimes, so
+    only datetimes are compared with them in SQL
+    """
+    if type(value) is datetime and value.microsecond == 0:
+        return value.strftime(TIMESTAMP_FORMAT)
+    if not timestamp and (value is None or type(value) in (str, int, float)):
+        return value
+    raise TypeError("{} is not an SQL parameter".format(type(value)))
+
+
+def _condition(column: str, value) -> tuple:
+    """ Return the SQL condition and parameters of a search value
+    """
+    timestamp = column in TIMESTAMP_SLOTS
+    column = _quote(column)
+    if value is None:
+        return "{} IS NULL".format(column), []
+    if not isinstance(value, Range):
+        return "{} = ?".format(column), [_parameter(value, timestamp)]
+    conditions = []
+    params = []
+    if value.low is not None:
+        conditions.append("{} {} ?".format(
+            column, ">=" if value.include_low else ">"))
+        params.append(_parameter(value.low, timestamp))
+    if value.high is not None:
+        conditions.append("{} {} ?".format(
+            column, "<=" if value.include_high else "<"))
+        params.append(_parameter(value.high, timestamp))
+    if len(conditions) == 0:
+        conditions.append("{} IS NOT NULL".format(column))
+    return " AND ".join(conditions), params
+
+
+class SQLiteStorage(Storage):
+    """ Objects stored as the rows of one table per class
+
+    Each attribute of json_fields is a column and each of
+    indexed_attributes and sorted_attributes gets an SQL index. A save
+    is a single-row upsert and the database runs in WAL mode, so readers
+    never wait for a writer. No object is kept in memory: reads build
+    the objects from their rows. Attributes outside json_fields are not
+    stored.
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize the engine of a database file
+        """
+        self.file_path = file_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.file_path, timeout=5,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def columns(self, cls: type) -> tuple:
+        """ Return the columns of the table of a class, creating the
+        table, its missing columns and its indexes on first use
+        """
+        columns = self.tables.get(cls.__name__)
+        if columns is not None:
+            return columns
+        table = _quote(cls.__name__)
+        columns = tuple(cls.json_fields)
+        with self.lock:
+            db = self.connection()
+            db.execute("CREATE TABLE IF NOT EXISTS {} "
+                       "(id TEXT PRIMARY KEY)".format(table))
+            existing = {row[1] for row in db.execute(
+                "PRAGMA table_info({})".format(table))}
+            for column in columns:
+                if column not in existing:
+                    db.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                        table, _quote(column)))
+            for attribute in cls.indexed_attributes + cls.sorted_attributes:
+                db.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    _quote("{}_{}".format(cls.__name__, attribute)), table,
+                    _quote(attribute)))
+            self.tables[cls.__name__] = columns
+        return columns
+
+    def select(self, cls: type, where: str = "",
+               params: tuple = ()) -> List[TypeVar('Base')]:
+        """ Return the objects of the rows matching an SQL condition
+        """
+        columns = self.columns(cls)
+        rows = self.connection().execute(
+            "SELECT {} FROM {}{} ORDER BY rowid".format(
+                ", ".join(_quote(column) for column in columns),
+                _quote(cls.__name__), where), params)
+        return [cls(**dict(zip(columns, row))) for row in rows]
+
+    def load(self, cls: type):
+        """ Create the table of a class if needed, rows are read on demand
+        """
+        self.columns(cls)
+
+    def upsert(self, cls: type) -> str:
+        """ Return the statement inserting or updating a row of a class
+        """
+        columns = self.columns(cls)
+        names = ", ".join(_quote(column) for column in columns)
+        updates = ", ".join("{0} = excluded.{0}".format(_quote(column))
+                            for column in columns if column != "id")
+        return "INSERT INTO {} ({}) VALUES ({}) " \
+            "ON CONFLICT(id) DO UPDATE SET {}".format(
+                _quote(cls.__name__), names, ", ".join("?" * len(columns)),
+                updates)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update the row of an object
+        """
+        record = obj.to_json(True)
+        self.connection().execute(
+            self.upsert(obj.__class__),
+            [record.get(column) for column in self.columns(obj.__class__)])
+
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Insert or update the rows of objects in one transaction
+        """
+        columns = self.columns(cls)
+        db = self.connection()
+        db.execute("BEGIN")
+        try:
+            db.executemany(self.upsert(cls), (
+                [record.get(column) for column in columns]
+                for record in (obj.to_json(True) for obj in objs)))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of an object
+        """
+        self.columns(obj.__class__)
+        self.connection().execute("DELETE FROM {} WHERE id = ?".format(
+            _quote(obj.__class__.__name__)), (obj.id,))
+
+    def count(self, cls: type) -> int:
+        """ Count the rows of a class
+        """
+        self.columns(cls)
+        return self.connection().execute("SELECT COUNT(*) FROM {}".format(
+            _quote(cls.__name__))).fetchone()[0]
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return the object of a row by ID
+        """
+        objs = self.select(cls, " WHERE id = ?", (obj_id,))
+        return objs[0] if objs else None
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        Conditions on a column with a string, number, None or whole second
+        datetime value, or a Range of those, run in SQL, only datetimes
+        for created_at and updated_at. The others run on the objects
+        built from the rows
+        """
+        columns = self.columns(cls)
+        conditions = []
+        params = []
+        others = {}
+        for k, v in normalize_attributes(attributes).items():
+            try:
+                if k not in columns:
+                    raise TypeError("{} is not a column".format(k))
+                condition, condition_params = _condition(k, v)
+            except TypeError:
+                others[k] = v
+                continue
+            conditions.append(condition)
+            params.extend(condition_params)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        objs = self.select(cls, where, tuple(params))
+        return [obj for obj in objs
+                if all(matches(getattr(obj, k), v) for k, v in others.items())]
@@ -9,6 +9,11 @@ class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    json_fields = Base.json_fields + __slots__
+    indexed_attributes = ("email",)
+    sorted_attributes = ("created_at",)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+""" Convert Base snapshot files and benchmark their load time
+
+Usage:
+    ./snapshot_tool.py convert <Class> json|pickle
+    ./snapshot_tool.py reshard <Class> <shards> [json|pickle]
+    ./snapshot_tool.py benchmark [count ...]
+
+convert rewrites the snapshot files of a class in a format, as
+.db_<Class>.json or .db_<Class>.pickle, and the class must then set the
+same snapshot_format. reshard moves the single file or the shard files
+of a class to the given number of shards, 1 meaning the single-file
+layout, in the given format.
+"""
+import os
+import sys
+import tempfile
+import time
+from models.base import DATA
+from models.json_storage import (convert_snapshot, reshard, snapshot_files,
+                                 write_snapshot)
+from models.user import User
+
+
+def make_users(count: int) -> dict:
+    """ Return the JSON of count synthetic users by ID, created over a day
+    """
+    users = {}
+    for i in range(count):
+        user_id = "{:08d}-0000-4000-8000-000000000000".format(i)
+        users[user_id] = {
+            "id": user_id,
+            "created_at": "2024-01-01T{:02d}:{:02d}:{:02d}".format(
+                i // 3600 % 24, i // 60 % 60, i % 60),
+            "updated_at": "2024-06-01T12:30:00",
+            "email": "user{}@hbtn.io".format(i),
+            "_password": "0" * 64,
+            "first_name": "First{}".format(i),
+            "last_name": "Last{}".format(i),
+        }
+    return users
+
+
+def time_load() -> float:
+    """ Return the seconds taken by User.load_from_file
+    """
+    start = time.perf_counter()
+    User.load_from_file()
+    return time.perf_counter() - start
+
+
+def benchmark(counts: list):
+    """ Print JSON and pickle load times for each user count
+    """
+    print("{:>10} {:>10} {:>10} {:>8}".format("users", "json s",
+                                              "pickle s", "speedup"))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for count in counts:
+                write_snapshot(".db_User.json", make_users(count))
+                json_time = time_load()
+                DATA["User"] = {}
+                convert_snapshot(".db_User.json", "pickle")
+                User.snapshot_format = "pickle"
+                pickle_time = time_load()
+                assert User.count() == count
+                print("{:>10} {:>10.3f} {:>10.3f} {:>7.1f}x".format(
+                    count, json_time, pickle_time, json_time / pickle_time))
+                os.remove(".db_User.pickle")
+                User.snapshot_format = "json"
+                DATA["User"] = {}
+        finally:
+            User.snapshot_format = "json"
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        for file_path in snapshot_files(sys.argv[2]):
+            convert_snapshot(file_path, sys.argv[3])
+    elif len(sys.argv) in (4, 5) and sys.argv[1] == "reshard":
+        reshard(sys.argv[2], int(sys.argv[3]), *sys.argv[4:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == "benchmark":
+        benchmark([int(count) for count in sys.argv[2:]] or
+                  [1000, 10000, 100000])
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+""" Checks of the Base storage modes
+
+Usage:
+    ./storage_check.py [mode ...]
+
+Each storage mode saves, removes and reloads users, then saves and
+removes them from several threads while others read. Journaled modes
+also check compaction and a torn last journal line, coherent modes the
+changes written by another process. With no mode, all are checked.
+
+Every check prints OK or FAIL and the script exits with status 1 if one
+failed.
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from models.base import DATA, INDEXES, Range
+from models.json_storage import FLUSHERS, JOURNALS, PENDING_SHARDS, SIGNATURES
+from models.user import User
+
+MODES = {
+    "json": {},
+    "journaled": {"journaled": True},
+    "write_behind": {"write_behind": True, "write_behind_ms": 10},
+    "sharded": {"shards": 4},
+    "pickle": {"snapshot_format": "pickle"},
+    "journaled_pickle": {"journaled": True, "snapshot_format": "pickle"},
+    "lazy_load": {"lazy_load": True},
+    "epoch_timestamps": {"epoch_timestamps": True},
+    "coherent": {"coherent": True},
+    "journaled_coherent": {"journaled": True, "coherent": True},
+    "sqlite": {},
+}
+MODES_ATTRIBUTES = {attribute for attributes in MODES.values()
+                    for attribute in attributes}
+FAILURES = []
+
+
+def check(name: str, ok: bool):
+    """ Print the result of a check and remember the failures
+    """
+    print("    {:<40} {}".format(name, "OK" if ok else "FAIL"))
+    if not ok:
+        FAILURES.append(name)
+
+
+def set_mode(mode: str):
+    """ Set the class attributes and the engine of a mode on User
+    """
+    for attribute in MODES_ATTRIBUTES.intersection(vars(User)):
+        delattr(User, attribute)
+    for attribute, value in MODES[mode].items():
+        setattr(User, attribute, value)
+    os.environ["STORAGE_ENGINE"] = "sqlite" if mode == "sqlite" else "json"
+    os.environ["STORAGE_SQLITE_PATH"] = os.path.abspath(".db.sqlite3")
+
+
+def reset():
+    """ Forget the objects, journal and flusher of User in this process
+    """
+    User.flush()
+    journal = JOURNALS.pop("User", None)
+    if journal is not None:
+        if journal.compactor is not None:
+            journal.compactor.join()
+        if journal.file is not None:
+            journal.file.close()
+    FLUSHERS.pop("User", None)
+    SIGNATURES.pop("User", None)
+    PENDING_SHARDS.pop("User", None)
+    DATA.pop("User", None)
+    INDEXES.pop("User", None)
+
+
+def reload():
+    """ Load User again from disk, as a restarted process would
+    """
+    reset()
+    User.load_from_file()
+
+
+def make_users(count: int, prefix: str) -> list:
+    """ Create and save count users
+    """
+    users = []
+    for i in range(count):
+        user = User(email="{}{}@hbtn.io".format(prefix, i),
+                    first_name="First{}".format(i))
+        user.save()
+        users.append(user)
+    return users
+
+
+def emails() -> set:
+    """ Return the emails of all users
+    """
+    return {user.email for user in User.all()}
+
+
+def check_basics(mode: str):
+    """ Check save, remove and reload
+    """
+    users = make_users(20, "basic")
+    check("save count", User.count() == 20)
+    check("save get", User.get(users[3].id) == users[3])
+    found = User.search({"email": "basic7@hbtn.io"})
+    check("save search", [user.id for user in found] == [users[7].id])
+    for user in users[:5]:
+        user.remove()
+    check("remove count", User.count() == 15)
+    check("remove get", User.get(users[0].id) is None)
+    check("remove search", User.search({"email": "basic0@hbtn.io"}) == [])
+    users[10].first_name = "Changed"
+    users[10].save()
+
+    reload()
+    expected = {"basic{}@hbtn.io".format(i) for i in range(5, 20)}
+    check("reload objects", emails() == expected)
+    check("reload change", User.get(users[10].id).first_name == "Changed")
+    found = User.search({"email": "basic12@hbtn.io"})
+    check("reload search", [user.id for user in found] == [users[12].id])
+    created = User.search({"created_at": Range(datetime(2000, 1, 1), None)})
+    check("reload range search", len(created) == 15)
+    if mode == "sharded":
+        shard_files = [name for name in os.listdir(".")
+                       if name.startswith(".db_User.")]
+        check("shard files", len(shard_files) == User.shards)
+
+
+def check_compaction():
+    """ Check that the journal is folded into the snapshot once it holds
+    journal_compact_after records
+    """
+    User.journal_compact_after = 10
+    try:
+        reload()
+        users = make_users(25, "compact")
+        for user in users[:5]:
+            user.remove()
+        journal = JOURNALS["User"]
+        if journal.compactor is not None:
+            journal.compactor.join()
+        check("compaction snapshot",
+              os.path.exists(journal.snapshot_path) and
+              not os.path.exists(journal.compacting_path))
+        check("compaction journal", journal.count < 30)
+        expected = emails()
+        reload()
+        check("compaction reload", emails() == expected)
+    finally:
+        del User.journal_compact_after
+
+
+def check_torn_line():
+    """ Check that a last journal line cut by a crash is ignored, and
+    that the records appended after it are kept
+    """
+    make_users(3, "torn")
+    expected = emails()
+    journal = JOURNALS["User"]
+    with open(journal.file_path, 'ab') as f:
+        f.write(b'{"op": "save", "id": "torn-')
+    reload()
+    check("torn line ignored", emails() == expected)
+    user = User(email="after_torn@hbtn.io")
+    user.save()
+    reload()
+    check("append after torn line", emails() == expected | {user.email})
+
+
+def check_threads():
+    """ Check that saves and removes from several threads are all kept
+    while other threads read
+    """
+    errors = []
+    done = threading.Event()
+
+    def write(worker: int):
+        try:
+            users = make_users(30, "thread{}_".format(worker))
+            for user in users[:10]:
+                user.remove()
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            while not done.is_set():
+                User.count()
+                User.search({"first_name": "First1"})
+                for user in User.all():
+                    user.to_json()
+        except Exception as e:
+            errors.append(e)
+
+    before = emails()
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=write, args=(worker,))
+               for worker in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+    expected = before | {"thread{}_{}@hbtn.io".format(worker, i)
+                         for worker in range(4) for i in range(10, 30)}
+    check("threads no error", errors == [])
+    for e in errors[:3]:
+        print("        {!r}".format(e))
+    check("threads objects", emails() == expected)
+    reload()
+    check("threads reload", emails() == expected)
+
+
+def write_from_process(user_id: str):
+    """ Change a user and save a new one from another process
+    """
+    reload()
+    user = User.get(user_id)
+    user.first_name = "Other process"
+    user.save()
+    User(email="other_process@hbtn.io").save()
+    User.flush()
+
+
+def check_coherence():
+    """ Check that the changes of another process are seen without
+    reloading
+    """
+    user = make_users(1, "coherent")[0]
+    process = multiprocessing.Process(target=write_from_process,
+                                      args=(user.id,))
+    process.start()
+    process.join()
+    deadline = time.monotonic() + 5
+    while User.get(user.id).first_name != "Other process" and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    check("coherent change", User.get(user.id).first_name == "Other process")
+    found = User.search({"email": "other_process@hbtn.io"})
+    check("coherent new object", len(found) == 1)
+
+
+def run(mode: str):
+    """ Run the checks of a mode in an empty directory
+    """
+    print(mode)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            set_mode(mode)
+            reload()
+            check_basics(mode)
+            if User.journaled:
+                check_compaction()
+                check_torn_line()
+            if User.coherent:
+                check_coherence()
+            check_threads()
+        finally:
+            reset()
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    modes = sys.argv[1:] or list(MODES)
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        print(__doc__)
+        print("Modes: {}".format(", ".join(MODES)))
+        sys.exit(1)
+    for mode in modes:
+        run(mode)
+    if FAILURES:
+        print("{} checks failed".format(len(FAILURES)))
+        sys.exit(1)
+    print("All checks passed")
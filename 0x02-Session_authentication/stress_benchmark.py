@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress benchmark of the Base store
+
+Usage:
+    ./stress_benchmark.py [users] [operations] [write_percent]
+
+Each thread runs a mix of get, search, all, count and save on User
+objects while the file is written. The benchmark reports operations per
+second for 1 to 16 threads, the longest read and the errors seen.
+
+It first checks that lookups without the writer lock never miss an
+object while other threads save it, and that writing the file never
+fails while attributes are assigned. It exits with status 1 otherwise.
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable
+from models.base import DATA, Range, SortedIndex
+from models.user import User
+
+
+def populate(count: int):
+    """ Create count users and write them to file
+    """
+    User.load_from_file()
+    for i in range(count):
+        user = User(email="user{}@hbtn.io".format(i), first_name="First")
+        DATA["User"][user.id] = user
+        User.index(user)
+    User.save_to_file()
+
+
+def race(write: Callable, read: Callable, seconds: float) -> tuple:
+    """ Run write in a loop in one thread and read in another, return
+    the number of reads and of reads that returned False
+    """
+    done = threading.Event()
+
+    def writer():
+        while not done.is_set():
+            write()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reads = misses = 0
+    deadline = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < deadline:
+            reads += 1
+            if not read():
+                misses += 1
+    finally:
+        done.set()
+        thread.join()
+    return reads, misses
+
+
+def check_lookups(seconds: float) -> int:
+    """ Print and return the misses of lock-free lookups during saves
+    """
+    user = User.search({"email": "user0@hbtn.io"})[0]
+    index = SortedIndex("rank")
+    index.add_many((str(i), i) for i in range(1000))
+    state = {"rank": 0}
+
+    def move():
+        state["rank"] = (state["rank"] + 7) % 1000
+        index.add("moving", state["rank"] + 0.5)
+
+    users = User.all()
+
+    def rename():
+        for other in users:
+            other.first_name = "First"
+
+    def save_to_file():
+        try:
+            User.save_to_file()
+        except Exception:
+            return False
+        return True
+
+    checks = [
+        ("search by email during save", user.save,
+         lambda: User.search({"email": "user0@hbtn.io"}) == [user]),
+        ("save_to_file during assignments", rename, save_to_file),
+        ("sorted lookup during moves", move,
+         lambda: index.lookup(500) == ["500"] and
+         len(index.lookup_range(Range(100, 199))) in (100, 101)),
+    ]
+    total = 0
+    User.write_behind = True
+    try:
+        for name, write, read in checks:
+            reads, misses = race(write, read, seconds)
+            print("{}: {:,} reads, {} failed".format(name, reads, misses))
+            total += misses
+    finally:
+        User.flush()
+        User.write_behind = False
+    return total
+
+
+def worker(operations: int, write_percent: int, seed: int, stats: dict):
+    """ Run operations random reads and writes, record timings and errors
+    """
+    rand = random.Random(seed)
+    ids = list(DATA["User"].keys())
+    longest = 0.0
+    for _ in range(operations):
+        start = time.perf_counter()
+        try:
+            if rand.randrange(100) < write_percent:
+                user = User.get(rand.choice(ids))
+                user.first_name = "First{}".format(rand.randrange(1000))
+                user.save()
+                continue
+            operation = rand.randrange(4)
+            if operation == 0:
+                User.get(rand.choice(ids)).to_json()
+            elif operation == 1:
+                User.search({"email": "user{}@hbtn.io".format(
+                    rand.randrange(len(ids)))})
+            elif operation == 2:
+                User.count()
+            else:
+                len(User.all())
+        except Exception as e:
+            stats["errors"].append(repr(e))
+            continue
+        longest = max(longest, time.perf_counter() - start)
+    with stats["lock"]:
+        stats["longest_read"] = max(stats["longest_read"], longest)
+
+
+def run(threads: int, operations: int, write_percent: int) -> dict:
+    """ Run the workload on threads threads and return its statistics
+    """
+    stats = {"lock": threading.Lock(), "errors": [], "longest_read": 0.0}
+    workers = [threading.Thread(target=worker,
+                                args=(operations // threads, write_percent,
+                                      seed, stats))
+               for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    User.flush()
+    stats["ops_per_sec"] = operations / (time.perf_counter() - start)
+    return stats
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    write_percent = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            populate(users)
+            if check_lookups(2) > 0:
+                sys.exit(1)
+            for write_behind in (False, True):
+                User.write_behind = write_behind
+                print("write_behind={}".format(write_behind))
+                print("{:>8} {:>12} {:>16} {:>7}".format(
+                    "threads", "ops/s", "longest read ms", "errors"))
+                for threads in (1, 2, 4, 8, 16):
+                    stats = run(threads, operations, write_percent)
+                    print("{:>8} {:>12,.0f} {:>16.1f} {:>7}".format(
+                        threads, stats["ops_per_sec"],
+                        stats["longest_read"] * 1000, len(stats["errors"])))
+                    for error in set(stats["errors"]):
+                        print("    {}".format(error))
+            User.load_from_file()
+            assert User.count() == users
+        finally:
+            os.chdir(cwd)